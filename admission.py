@@ -0,0 +1,91 @@
+import asyncio
+import time
+from aiohttp import web
+from sessioncache import LRU
+
+'''
+Limits on how much of the server the expensive routes can use, so a burst
+of logins (which wait for recaptcha) or previews (which render markdown)
+can't make every other page wait. Every limited route has:
+
+- a token bucket for every ip, going over it is a 429
+- a maximum number of requests being handled at once, the others wait
+- a maximum number of waiting requests, going over it is a 503, and so is
+  waiting too long
+
+Rejected requests don't get an error page, they're meant to be as cheap as
+possible.
+'''
+
+
+class RouteLimit:
+	def __init__(self, concurrency, max_waiting, rate, burst, wait_timeout=5, max_ips=10000):
+		'''
+		rate is how many requests an ip can make per second after using
+		burst of them
+		'''
+		self.concurrency = concurrency
+		self.max_waiting = max_waiting
+		self.rate = rate
+		self.burst = burst
+		self.wait_timeout = wait_timeout
+		# made on first use, so it's made in the event loop that uses it
+		self.semaphore = None
+		self.waiting = 0
+		self.in_flight = 0
+		# {ip: [tokens, when they were counted]}
+		self.buckets = LRU(max_ips)
+		# {reason: how many requests were rejected for it}
+		self.shed = {'rate': 0, 'queue': 0, 'timeout': 0}
+
+	def take_token(self, ip):
+		'''
+		Returns whether the ip has a token left, and uses it if it does
+		'''
+		now = time.monotonic()
+		bucket = self.buckets.get(ip)
+		if bucket is None:
+			bucket = [self.burst, now]
+		else:
+			bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+			bucket[1] = now
+		if bucket[0] < 1:
+			allowed = False
+		else:
+			bucket[0] -= 1
+			allowed = True
+		# forgotten once it would be full again, which is the same as new
+		self.buckets.set(ip, bucket, time.time() + (self.burst - bucket[0]) / self.rate)
+		return allowed
+
+	def reject(self, reason, status_class, retry_after):
+		self.shed[reason] += 1
+		raise status_class(headers={'Retry-After': str(retry_after)})
+
+	async def handle(self, ip, handler, request):
+		if self.semaphore is None:
+			self.semaphore = asyncio.Semaphore(self.concurrency)
+		if not self.take_token(ip):
+			self.reject('rate', web.HTTPTooManyRequests, max(1, round(1 / self.rate)))
+		if self.semaphore.locked() and self.waiting >= self.max_waiting:
+			self.reject('queue', web.HTTPServiceUnavailable, 1)
+		self.waiting += 1
+		try:
+			await asyncio.wait_for(self.semaphore.acquire(), self.wait_timeout)
+		except asyncio.TimeoutError:
+			self.reject('timeout', web.HTTPServiceUnavailable, 1)
+		finally:
+			self.waiting -= 1
+		self.in_flight += 1
+		try:
+			return await handler(request)
+		finally:
+			self.in_flight -= 1
+			self.semaphore.release()
+
+	def stats(self):
+		return {
+			'in_flight': self.in_flight,
+			'waiting': self.waiting,
+			'shed': dict(self.shed),
+		}
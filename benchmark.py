@@ -0,0 +1,301 @@
+import os
+# the templates and images are found relative to the repo
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import motor.motor_asyncio
+import fakemongo
+# database.connect makes the client with this, so it has to be replaced first
+motor.motor_asyncio.AsyncIOMotorClient = fakemongo.FakeClient
+
+import argparse
+import asyncio
+import contextlib
+import inspect
+import json
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from yarl import URL
+import database as db
+import httpclient
+import main as server
+import markdown
+import highlight
+import search
+from timeago import timeago
+
+'''
+Benchmarks for the render pipeline: markdown, convert_post, timeago and the
+templates, against a generated corpus of posts in an in-memory database.
+
+python benchmark.py                   run everything and compare with the baseline
+python benchmark.py --save            run everything and save it as the new baseline
+python benchmark.py -k markdown       only run benchmarks with markdown in the name
+
+It exits with 1 if anything got slower than the baseline by more than the
+threshold, so it can be run before deploying.
+'''
+
+default_baseline = 'benchmark_baseline.json'
+
+session_id = 'a7d5f4c4-2c5b-4d7e-9c1a-5f0e9b1e2a3b'
+
+words = (
+	'the quick brown fox jumps over lazy dog python async await motor mongo '
+	'template render cache request response server client blog post image '
+	'markdown parse html code function class module import return value'
+).split()
+
+# real images, so their sizes are read from disk instead of downloaded
+images = sorted(os.listdir('website/images'))
+
+
+def make_paragraph(rand, sentences):
+	parts = []
+	for _ in range(sentences):
+		sentence = ' '.join(rand.choice(words) for _ in range(rand.randint(6, 16)))
+		roll = rand.random()
+		if roll < 0.15:
+			sentence += ' **' + rand.choice(words) + ' ' + rand.choice(words) + '**'
+		elif roll < 0.25:
+			sentence += ' *' + rand.choice(words) + '*'
+		elif roll < 0.35:
+			sentence += ' `' + rand.choice(words) + '()`'
+		elif roll < 0.42:
+			sentence += ' [' + rand.choice(words) + '](https://example.com/' + rand.choice(words) + ')'
+		elif roll < 0.47:
+			sentence += ' [' + rand.choice(words) + '](/blog/post/' + rand.choice(words) + ')'
+		elif roll < 0.52:
+			sentence += ' https://matdoes.dev/' + rand.choice(words)
+		parts.append(sentence.capitalize() + '.')
+	return ' '.join(parts)
+
+def make_post(rand, sections):
+	'''
+	Makes the markdown for a post with every kind of formatting, each section
+	has a title, a few paragraphs and sometimes an image, quote or code block
+	'''
+	lines = []
+	for i in range(sections):
+		lines.append('#' * rand.randint(1, 3) + ' ' + make_paragraph(rand, 1).rstrip('.'))
+		for _ in range(rand.randint(1, 4)):
+			lines.append(make_paragraph(rand, rand.randint(2, 6)))
+			lines.append('')
+		roll = rand.random()
+		if roll < 0.3:
+			prefix = rand.choice(['', ',', '.'])
+			lines.append(f'{prefix}![{rand.choice(words)} image](/images/{rand.choice(images)})')
+		elif roll < 0.5:
+			lines.append('> ' + make_paragraph(rand, 2))
+		elif roll < 0.8:
+			lines.append('```py')
+			for _ in range(rand.randint(3, 15)):
+				lines.append('\t' + ' '.join(rand.choice(words) for _ in range(5)) + '()')
+			lines.append('```')
+		else:
+			lines.append('---')
+		if rand.random() < 0.2:
+			lines.append('||' + make_paragraph(rand, 1) + '||')
+	return '\n'.join(lines)
+
+def make_corpus(seed=1):
+	rand = random.Random(seed)
+	return {
+		'small': make_post(rand, 1),
+		'typical': make_post(rand, 8),
+		'large': make_post(rand, 400),
+	}
+
+
+async def seed_database(corpus, count=40):
+	'''
+	Fills the fake posts and sessions collections, returns the slug of a
+	typical post
+	'''
+	rand = random.Random(2)
+	sizes = ['small', 'typical', 'typical', 'typical']
+	slug = None
+	for i in range(count):
+		size = 'large' if i == count // 2 else sizes[i % len(sizes)]
+		document = await db.get_blog_post_dict(f'Post {i} {rand.choice(words)}', corpus[size], 'mat', unlisted=i % 10 == 3)
+		document['datetime'] = datetime(2020, 1, 1) + timedelta(days=i)
+		await db.blog_posts.insert_one(document)
+		if size == 'typical' and slug is None:
+			slug = document['slug']
+	await db.sessions_db.insert_one({'_id': session_id, 'username': 'mat', 'created': datetime.utcnow()})
+	return slug
+
+
+async def measure(function, min_time):
+	'''
+	Calls function (which can return an awaitable) until min_time has
+	passed, and then once more with tracemalloc to see how much it allocates
+	'''
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		# the log events are still written, they're just not shown
+		return await measure_quietly(function, min_time)
+
+async def measure_quietly(function, min_time):
+	# warm up, so caches and compiled templates aren't counted
+	result = function()
+	is_async = inspect.isawaitable(result)
+	if is_async:
+		await result
+
+	iterations = 0
+	start = time.perf_counter()
+	elapsed = 0
+	while elapsed < min_time:
+		result = function()
+		if is_async:
+			await result
+		iterations += 1
+		elapsed = time.perf_counter() - start
+
+	tracemalloc.start()
+	tracemalloc.reset_peak()
+	before, _ = tracemalloc.get_traced_memory()
+	result = function()
+	if is_async:
+		await result
+	after, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return {
+		'ops_per_second': iterations / elapsed,
+		'us_per_op': elapsed / iterations * 1000000,
+		'peak_alloc_bytes': peak - before,
+		# memory that's still used after the call, which should only be
+		# caches filling up
+		'retained_bytes': after - before,
+	}
+
+
+async def get_benchmarks(corpus):
+	# the templates inline their loadurls, these stand in for the cdn files
+	for url in server.find_loadurls():
+		server.loadurls.contents[url] = f'/* {url} */\n' + 'a{color:red}\n' * 200
+
+	db.connect()
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		slug = await seed_database(corpus)
+		all_posts = await db.get_blog_posts(get_hidden=True)
+		server.load_sitemap(all_posts)
+		stored_post = await db.blog_posts.find_one({'slug': slug})
+		unrendered_post = dict(stored_post, renderer_version=None)
+		posts, newer, older = await db.get_blog_post_page(10)
+		rss_posts, _, rss_older = await db.get_blog_post_page(20, get_html=True)
+		post = await db.get_blog_post(slug)
+	small_index = search.SearchIndex()
+	small_index.update(all_posts)
+	# the same posts over and over, to see how searching scales with the archive
+	large_index = search.SearchIndex()
+	for i in range(25):
+		for p in all_posts:
+			large_index.add(dict(p, id=f'{p["id"]}-{i}'))
+	query = ' '.join(random.Random(3).sample(words, 2))
+	url = URL('https://matdoes.dev/blog')
+	last_month = datetime.now() - timedelta(days=31)
+
+	benchmarks = {}
+	for size, content in corpus.items():
+		benchmarks[f'parse_markdown[{size}]'] = lambda content=content: markdown.parse_markdown(content)
+		benchmarks[f'remove_markdown[{size}]'] = lambda content=content: markdown.remove_markdown(content)
+	# code blocks are highlighted again instead of coming from the cache
+	benchmarks['parse_markdown[typical,uncached]'] = lambda: (highlight.clear(), markdown.parse_markdown(corpus['typical']))
+	benchmarks.update({
+		'convert_post[stored]': lambda: db.convert_post(dict(stored_post), get_html=True),
+		'convert_post[unrendered]': lambda: db.convert_post(dict(unrendered_post), get_html=True),
+		'timeago[datetime]': lambda: timeago(last_month),
+		'timeago[seconds]': lambda: timeago(372.5, 'read', False, True),
+		'get_blog_post_page[10]': lambda: db.get_blog_post_page(10),
+		'get_blog_post': lambda: db.get_blog_post(slug),
+		'get_session': lambda: db.get_session(session_id),
+		'search.add': lambda: small_index.add(post),
+		f'search[{len(small_index)}]': lambda: small_index.search(query),
+		f'search[{len(large_index)}]': lambda: large_index.search(query),
+		'template[index.html]': lambda: server.load_template('index.html', url=url, static=True),
+		'template[blog.html]': lambda: server.load_template('blog.html', url=url, posts=posts, is_admin=False, newer=newer, older=older),
+		'template[blogpost.html]': lambda: server.load_template('blogpost.html', url=url, p=post, is_admin=False),
+		'template[blog.xml]': lambda: server.load_template('blog.xml', url=url, posts=rss_posts, older=rss_older),
+		'template[sitemap.xml]': lambda: server.load_template('sitemap.xml', url=url, sitemap=server.sitemap_dict),
+	})
+	return benchmarks
+
+
+def compare(results, baseline, threshold):
+	'''
+	Prints how each result changed from the baseline, returns the names of
+	the ones that got slower by more than threshold
+	'''
+	regressions = []
+	print()
+	print(f'{"benchmark":<32} {"baseline":>12} {"now":>12} {"change":>8}')
+	for name, result in results.items():
+		if name not in baseline:
+			print(f'{name:<32} {"-":>12} {result["ops_per_second"]:>12.1f} {"new":>8}')
+			continue
+		old = baseline[name]['ops_per_second']
+		change = result['ops_per_second'] / old - 1
+		flag = ''
+		if change < -threshold:
+			flag = '  <- slower'
+			regressions.append(name)
+		print(f'{name:<32} {old:>12.1f} {result["ops_per_second"]:>12.1f} {change:>+8.1%}{flag}')
+	return regressions
+
+async def run(args):
+	corpus = make_corpus()
+	benchmarks = await get_benchmarks(corpus)
+	results = {}
+	print(f'{"benchmark":<32} {"ops/s":>12} {"us/op":>12} {"peak alloc":>12} {"retained":>12}')
+	for name, function in benchmarks.items():
+		if args.k and args.k not in name:
+			continue
+		result = await measure(function, args.time)
+		results[name] = result
+		print(
+			f'{name:<32} {result["ops_per_second"]:>12.1f} {result["us_per_op"]:>12.1f}'
+			f' {result["peak_alloc_bytes"] / 1024:>10.1f}KB {result["retained_bytes"] / 1024:>10.1f}KB'
+		)
+	await httpclient.close()
+	return results
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmarks for the render pipeline')
+	parser.add_argument('-k', help='only run benchmarks with this in their name')
+	parser.add_argument('--time', type=float, default=0.5, help='seconds to run each benchmark for')
+	parser.add_argument('--baseline', default=default_baseline, help='baseline json to compare with or save to')
+	parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+	parser.add_argument('--threshold', type=float, default=0.15, help='how much slower counts as a regression')
+	args = parser.parse_args()
+
+	results = asyncio.run(run(args))
+
+	if args.save:
+		baseline = {}
+		if os.path.isfile(args.baseline):
+			with open(args.baseline, 'r') as f:
+				baseline = json.load(f)
+		baseline.update(results)
+		with open(args.baseline, 'w') as f:
+			json.dump(baseline, f, indent='\t', sort_keys=True)
+		print('Saved baseline to', args.baseline)
+		return 0
+
+	if not os.path.isfile(args.baseline):
+		print('No baseline to compare with, make one with --save')
+		return 0
+	with open(args.baseline, 'r') as f:
+		baseline = json.load(f)
+	regressions = compare(results, baseline, args.threshold)
+	if regressions:
+		print(len(regressions), 'benchmarks got slower:', ', '.join(regressions))
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
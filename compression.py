@@ -0,0 +1,95 @@
+import gzip
+import os
+import sys
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+'''
+gzip and brotli for responses. Pages are compressed once when they're
+cached, and files in website/ are compressed ahead of time into .gz and .br
+files next to them, which aiohttp sends instead of the original.
+'''
+
+# in order of preference
+encodings = ['br', 'gzip'] if brotli else ['gzip']
+
+# anything smaller than this isn't worth compressing
+min_size = 512
+
+compressible_types = {
+	'text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript',
+	'application/json', 'application/xml', 'application/rss+xml',
+	'application/javascript', 'image/svg+xml', 'image/x-icon',
+	'image/vnd.microsoft.icon',
+}
+
+compressible_extensions = {
+	'.html', '.css', '.txt', '.xml', '.js', '.json', '.svg', '.ico',
+}
+
+
+def is_compressible(content_type):
+	return content_type in compressible_types
+
+def choose_encoding(accept_encoding):
+	'''
+	Returns the best encoding in the Accept-Encoding header that we support,
+	or None if the response should be sent uncompressed
+	'''
+	accepted = set()
+	for item in accept_encoding.lower().split(','):
+		name, _, params = item.partition(';')
+		params = params.replace(' ', '')
+		if params.startswith('q=') and params[2:] in {'0', '0.0', '0.00', '0.000'}:
+			continue
+		accepted.add(name.strip())
+	for encoding in encodings:
+		if encoding in accepted or '*' in accepted:
+			return encoding
+	return None
+
+def compress(body, encoding, best=False):
+	if encoding == 'br':
+		return brotli.compress(body, quality=11 if best else 5)
+	return gzip.compress(body, compresslevel=9 if best else 6)
+
+def precompress_directory(directory):
+	'''
+	Writes a .gz (and .br if brotli is installed) file next to every
+	compressible file in directory that doesn't have an up to date one
+	already, returns how many files were written
+	'''
+	extensions = {'gzip': '.gz', 'br': '.br'}
+	written = 0
+	for root, _, filenames in os.walk(directory):
+		for filename in filenames:
+			if os.path.splitext(filename)[1].lower() not in compressible_extensions:
+				continue
+			path = os.path.join(root, filename)
+			mtime = os.path.getmtime(path)
+			body = None
+			for encoding in encodings:
+				compressed_path = path + extensions[encoding]
+				if os.path.exists(compressed_path) and os.path.getmtime(compressed_path) >= mtime:
+					continue
+				if body is None:
+					with open(path, 'rb') as f:
+						body = f.read()
+				compressed = compress(body, encoding, best=True)
+				if len(compressed) >= len(body):
+					# not worth it, and aiohttp would still send it
+					if os.path.exists(compressed_path):
+						os.remove(compressed_path)
+					continue
+				with open(compressed_path, 'wb') as f:
+					f.write(compressed)
+				written += 1
+	return written
+
+
+if __name__ == '__main__':
+	directory = sys.argv[1] if len(sys.argv) > 1 else 'website'
+	print('Compressed', precompress_directory(directory), 'files')
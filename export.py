@@ -0,0 +1,284 @@
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import html
+import http
+import json
+import os
+import re
+import time
+import urllib.parse
+from aiohttp.test_utils import TestClient, TestServer
+from yarl import URL
+import compression
+import main
+
+'''
+Renders every public page of the site into a directory, so it can be
+served by nginx or a cdn without running python. The pages are gotten from
+the app itself, so they're exactly what it would send to someone that isn't
+logged in. Links are followed from the index, blog, rss and sitemap, and
+the files in website/ are copied too. Every file gets .gz and .br files next
+to it, and files that didn't change since the last export aren't written
+again.
+
+python3 export.py output [--jobs 8]
+
+The pages with a cursor are written to blog/before/<cursor>.html and so on,
+an nginx config to serve the export (and send everything else to the app)
+looks like:
+
+	root /srv/matdoes.dev;
+	gzip_static on;
+	brotli_static on;
+	error_page 404 /404.html;
+	location = /blog {
+		if ($arg_before ~ ^[0-9a-zA-Z-]+$) { rewrite ^ /blog/before/$arg_before.html break; }
+		if ($arg_after ~ ^[0-9a-zA-Z-]+$) { rewrite ^ /blog/after/$arg_after.html break; }
+		try_files /blog.html =404;
+	}
+	location = /rss {
+		default_type application/rss+xml;
+		if ($arg_before ~ ^[0-9a-zA-Z-]+$) { rewrite ^ /rss/before/$arg_before.xml break; }
+		try_files /rss.xml =404;
+	}
+	location ~ ^/(blog/(new|edit|preview|login|search|cache)|metrics) {
+		proxy_pass http://127.0.0.1:8080;
+		# so the server doesn't think requests are from localhost
+		proxy_set_header X-Forwarded-For $remote_addr;
+	}
+	location /.well-known {
+		default_type application/json;
+		add_header Access-Control-Allow-Origin *;
+	}
+	location / {
+		try_files $uri $uri.html =404;
+	}
+'''
+
+# where the hashes of the files from the last export are kept
+manifest_filename = '.export.json'
+compressed_extensions = {'gzip': '.gz', 'br': '.br'}
+
+# everything else is found by following links from these
+start_paths = ['/', '/projects', '/blog', '/rss', '/sitemap.xml']
+error_statuses = [404, 500]
+
+site_hosts = {'matdoes.dev', 'www.matdoes.dev'}
+# slugs and the cursors from encode_cursor, this also makes sure they
+# can't be used to write outside of the output directory
+name_pattern = re.compile(r'[\w-]+')
+link_pattern = re.compile(r'(?:href="|<loc>)([^"<]+)')
+
+
+def get_output_path(path, query):
+	'''
+	Returns where the page at path (with a list of query string pairs) is
+	written in the output directory, or None if it isn't exported
+	'''
+	if path in ('/blog', '/rss'):
+		name = path[1:]
+		extension = '.html' if path == '/blog' else '.xml'
+		if not query:
+			return name + extension
+		cursor_names = {'before', 'after'} if path == '/blog' else {'before'}
+		if len(query) == 1 and query[0][0] in cursor_names and name_pattern.fullmatch(query[0][1]):
+			return f'{name}/{query[0][0]}/{query[0][1]}{extension}'
+		return None
+	if query:
+		return None
+	if path == '/':
+		return 'index.html'
+	if path == '/projects':
+		return 'projects.html'
+	if path.startswith('/blog/post/') and name_pattern.fullmatch(path[11:]):
+		return path[1:] + '.html'
+	if path == '/sitemap.xml' or re.fullmatch(r'/sitemap-\d+\.xml', path):
+		return path[1:]
+	return None
+
+def find_links(path, body):
+	'''
+	Returns the (path, query) of every link on the page that's exported
+	'''
+	links = []
+	for link in link_pattern.findall(body.decode(errors='replace')):
+		parts = urllib.parse.urlsplit(html.unescape(link))
+		if parts.netloc and parts.netloc not in site_hosts:
+			continue
+		link_path = urllib.parse.unquote(parts.path)
+		# posts are only exported if they're in the sitemap, so unlisted
+		# posts that are linked to somewhere aren't
+		if link_path.startswith('/blog/post/') and not path.startswith('/sitemap'):
+			continue
+		query = urllib.parse.parse_qsl(parts.query)
+		if get_output_path(link_path, query) is not None:
+			links.append((link_path, query))
+	return links
+
+
+def hash_body(body):
+	return hashlib.sha256(body).hexdigest()
+
+def write_file(output_dir, relative_path, body):
+	'''
+	Writes the file and its compressed versions, this is done in a thread
+	since compressing with the best settings is slow
+	'''
+	path = os.path.join(output_dir, relative_path)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, 'wb') as f:
+		f.write(body)
+	compressible = (
+		os.path.splitext(path)[1] in compression.compressible_extensions
+		and len(body) >= compression.min_size
+	)
+	for encoding, extension in compressed_extensions.items():
+		compressed = None
+		if compressible and encoding in compression.encodings:
+			compressed = compression.compress(body, encoding, best=True)
+		if compressed is None or len(compressed) >= len(body):
+			remove_file(path + extension)
+			continue
+		with open(path + extension, 'wb') as f:
+			f.write(compressed)
+
+def remove_file(path):
+	try:
+		os.remove(path)
+	except FileNotFoundError:
+		pass
+
+
+class Export:
+	def __init__(self, output_dir, jobs):
+		self.output_dir = output_dir
+		self.jobs = jobs
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+		try:
+			with open(os.path.join(output_dir, manifest_filename)) as f:
+				self.old_hashes = json.load(f)
+		except (OSError, ValueError):
+			self.old_hashes = {}
+		# {relative path: sha256 of the file}
+		self.hashes = {}
+		self.changed = 0
+		self.errors = []
+
+	async def save(self, relative_path, body):
+		if relative_path in self.hashes:
+			return
+		digest = hash_body(body)
+		self.hashes[relative_path] = digest
+		if self.old_hashes.get(relative_path) == digest and os.path.exists(os.path.join(self.output_dir, relative_path)):
+			return
+		self.changed += 1
+		await asyncio.get_event_loop().run_in_executor(self.executor, write_file, self.output_dir, relative_path, body)
+
+	async def export_pages(self, client):
+		host = URL(main.db.base_url).host
+		seen = set()
+		queue = asyncio.Queue()
+
+		def add(path, query):
+			key = (path, tuple(query))
+			if key not in seen:
+				seen.add(key)
+				queue.put_nowait((path, query))
+
+		async def export_page(path, query):
+			r = await client.get(
+				path, params=query, allow_redirects=False,
+				# so the canonical urls are the real ones, and the page
+				# isn't compressed since that's done later
+				headers={'Host': host, 'Accept-Encoding': 'identity'}
+			)
+			body = await r.read()
+			if r.status != 200:
+				self.errors.append(f'{path} {urllib.parse.urlencode(query)} returned {r.status}')
+				return
+			for link in find_links(path, body):
+				add(*link)
+			await self.save(get_output_path(path, query), body)
+
+		async def worker():
+			while True:
+				path, query = await queue.get()
+				try:
+					await export_page(path, query)
+				except Exception as e:
+					self.errors.append(f'{path} {urllib.parse.urlencode(query)} failed: {e!r}')
+				finally:
+					queue.task_done()
+
+		for path in start_paths:
+			add(path, [])
+		tasks = [asyncio.ensure_future(worker()) for _ in range(self.jobs)]
+		await queue.join()
+		for task in tasks:
+			task.cancel()
+
+	async def export_error_pages(self):
+		for status in error_statuses:
+			body = await main.load_template(
+				'error.html', url=URL(main.db.base_url + f'/{status}'),
+				status=status, message=http.HTTPStatus(status).phrase
+			)
+			await self.save(f'{status}.html', body.encode())
+
+	async def export_static_files(self):
+		for root, _, filenames in os.walk('website'):
+			for filename in filenames:
+				# they're made again for the export
+				if filename.endswith(('.gz', '.br')):
+					continue
+				path = os.path.join(root, filename)
+				with open(path, 'rb') as f:
+					body = f.read()
+				await self.save(os.path.relpath(path, 'website'), body)
+
+	def remove_old_files(self):
+		removed = 0
+		for relative_path in set(self.old_hashes) - set(self.hashes):
+			path = os.path.join(self.output_dir, relative_path)
+			for extension in ['', *compressed_extensions.values()]:
+				remove_file(path + extension)
+			removed += 1
+		with open(os.path.join(self.output_dir, manifest_filename), 'w') as f:
+			json.dump(self.hashes, f)
+		return removed
+
+	async def run(self):
+		os.makedirs(self.output_dir, exist_ok=True)
+		client = TestClient(TestServer(main.create_app()))
+		await client.start_server()
+		try:
+			await self.export_pages(client)
+			await self.export_error_pages()
+		finally:
+			await client.close()
+		await self.export_static_files()
+		self.executor.shutdown()
+		return self.remove_old_files()
+
+
+async def export(output_dir, jobs):
+	start = time.perf_counter()
+	exporter = Export(output_dir, jobs)
+	removed = await exporter.run()
+	for error in exporter.errors:
+		print('Error:', error)
+	print(
+		f'Exported {len(exporter.hashes)} files to {output_dir} in {time.perf_counter() - start:.2f}s'
+		f' ({exporter.changed} changed, {removed} removed)'
+	)
+	return not exporter.errors
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Renders the public pages of the site into a directory')
+	parser.add_argument('output', help='directory to write the site to')
+	parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='how many pages are rendered and compressed at once')
+	args = parser.parse_args()
+	if not asyncio.run(export(args.output, args.jobs)):
+		raise SystemExit(1)
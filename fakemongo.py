@@ -0,0 +1,263 @@
+import copy
+import uuid
+
+'''
+An in-memory stand-in for the parts of motor that database.py uses, so the
+benchmarks and load tests can run without a mongo server or the network.
+Use it by replacing motor.motor_asyncio.AsyncIOMotorClient with FakeClient
+before database is imported.
+'''
+
+
+def get_field(document, key):
+	for part in key.split('.'):
+		if not isinstance(document, dict) or part not in document:
+			return None, False
+		document = document[part]
+	return document, True
+
+def compare(a, b):
+	# like mongo, comparing different types is never true
+	try:
+		return (a > b) - (a < b)
+	except TypeError:
+		return None
+
+def match_operator(value, exists, operator, argument):
+	if operator == '$exists':
+		return exists == bool(argument)
+	if operator == '$ne':
+		return value != argument
+	if operator == '$in':
+		return value in argument
+	if operator == '$nin':
+		return value not in argument
+	if not exists:
+		return False
+	result = compare(value, argument)
+	if result is None:
+		return False
+	if operator == '$lt':
+		return result < 0
+	if operator == '$lte':
+		return result <= 0
+	if operator == '$gt':
+		return result > 0
+	if operator == '$gte':
+		return result >= 0
+	raise NotImplementedError(f'{operator} is not supported')
+
+def matches(document, query):
+	for key, condition in query.items():
+		if key == '$or':
+			if not any(matches(document, q) for q in condition):
+				return False
+			continue
+		if key == '$and':
+			if not all(matches(document, q) for q in condition):
+				return False
+			continue
+		value, exists = get_field(document, key)
+		if isinstance(condition, dict) and condition and next(iter(condition)).startswith('$'):
+			for operator, argument in condition.items():
+				if not match_operator(value, exists, operator, argument):
+					return False
+		elif value != condition:
+			return False
+	return True
+
+def project(document, projection):
+	if not projection:
+		return copy.deepcopy(document)
+	if isinstance(projection, (list, tuple)):
+		projection = {key: 1 for key in projection}
+	include = any(v for k, v in projection.items() if k != '_id')
+	if include:
+		result = {k: copy.deepcopy(document[k]) for k in projection if projection[k] and k in document}
+		if projection.get('_id', 1) and '_id' in document:
+			result['_id'] = document['_id']
+		return result
+	return {k: copy.deepcopy(v) for k, v in document.items() if projection.get(k, 1)}
+
+def normalize_sort(key_or_list, direction=None):
+	if isinstance(key_or_list, str):
+		return [(key_or_list, direction or 1)]
+	return list(key_or_list)
+
+def sort_documents(documents, sort):
+	# sorting by each key from the last one keeps the earlier keys first
+	for key, direction in reversed(sort):
+		documents.sort(
+			key=lambda d: SortKey(get_field(d, key)[0]),
+			reverse=direction == -1
+		)
+
+class SortKey:
+	# None sorts before everything else, like a missing field in mongo
+	def __init__(self, value):
+		self.value = value
+
+	def __lt__(self, other):
+		if self.value is None:
+			return other.value is not None
+		if other.value is None:
+			return False
+		return compare(self.value, other.value) == -1
+
+def apply_update(document, update):
+	for operator, fields in update.items():
+		if operator == '$set':
+			document.update(copy.deepcopy(fields))
+		elif operator == '$unset':
+			for key in fields:
+				document.pop(key, None)
+		elif operator == '$inc':
+			for key, amount in fields.items():
+				document[key] = document.get(key, 0) + amount
+		elif operator == '$push':
+			for key, value in fields.items():
+				document.setdefault(key, []).append(copy.deepcopy(value))
+		else:
+			raise NotImplementedError(f'{operator} is not supported')
+
+
+class UpdateResult:
+	def __init__(self, matched_count, modified_count, upserted_id=None):
+		self.matched_count = matched_count
+		self.modified_count = modified_count
+		self.upserted_id = upserted_id
+
+
+class FakeCursor:
+	def __init__(self, collection, query, projection):
+		self.collection = collection
+		self.query = query or {}
+		self.projection = projection
+		self.sort_keys = []
+		self.limit_count = 0
+		self.results = None
+
+	def sort(self, key_or_list, direction=None):
+		self.sort_keys = normalize_sort(key_or_list, direction)
+		return self
+
+	def limit(self, count):
+		self.limit_count = count
+		return self
+
+	def get_results(self):
+		documents = [d for d in self.collection.documents.values() if matches(d, self.query)]
+		if self.sort_keys:
+			sort_documents(documents, self.sort_keys)
+		if self.limit_count > 0:
+			documents = documents[:self.limit_count]
+		return [project(d, self.projection) for d in documents]
+
+	def __aiter__(self):
+		return self
+
+	async def __anext__(self):
+		if self.results is None:
+			self.results = iter(self.get_results())
+		try:
+			return next(self.results)
+		except StopIteration:
+			raise StopAsyncIteration
+
+	async def to_list(self, length=None):
+		results = self.get_results()
+		return results if length is None else results[:length]
+
+
+class FakeCollection:
+	def __init__(self, name):
+		self.name = name
+		self.documents = {}
+		self.indexes = []
+
+	def find(self, query=None, projection=None):
+		return FakeCursor(self, query, projection)
+
+	async def find_one(self, query=None, projection=None, sort=None):
+		cursor = self.find(query, projection).limit(1)
+		if sort is not None:
+			cursor.sort(sort)
+		results = cursor.get_results()
+		return results[0] if results else None
+
+	async def insert_one(self, document):
+		if '_id' not in document:
+			document['_id'] = uuid.uuid4().hex
+		if document['_id'] in self.documents:
+			raise ValueError(f'Duplicate _id {document["_id"]!r}')
+		self.documents[document['_id']] = copy.deepcopy(document)
+
+	async def update_one(self, query, update, upsert=False):
+		for document in self.documents.values():
+			if matches(document, query):
+				apply_update(document, update)
+				return UpdateResult(1, 1)
+		if not upsert:
+			return UpdateResult(0, 0)
+		document = {k: v for k, v in query.items() if not k.startswith('$')}
+		apply_update(document, update)
+		await self.insert_one(document)
+		return UpdateResult(0, 0, document['_id'])
+
+	async def update_many(self, query, update, upsert=False):
+		count = 0
+		for document in self.documents.values():
+			if matches(document, query):
+				apply_update(document, update)
+				count += 1
+		return UpdateResult(count, count)
+
+	async def delete_one(self, query):
+		for key, document in self.documents.items():
+			if matches(document, query):
+				del self.documents[key]
+				return
+
+	async def count_documents(self, query):
+		return sum(1 for d in self.documents.values() if matches(d, query))
+
+	async def create_index(self, keys, **kwargs):
+		self.indexes.append((keys, kwargs))
+
+
+class FakeDatabase:
+	def __init__(self, name):
+		self.name = name
+		self.collections = {}
+
+	def __getattr__(self, name):
+		if name.startswith('_'):
+			raise AttributeError(name)
+		return self[name]
+
+	def __getitem__(self, name):
+		if name not in self.collections:
+			self.collections[name] = FakeCollection(name)
+		return self.collections[name]
+
+
+class FakeClient:
+	# every client sees the same data, like they're connected to the same
+	# server, so it's still there after reconnecting
+	shared_databases = {}
+
+	def __init__(self, *args, **kwargs):
+		self.databases = FakeClient.shared_databases
+
+	def __getattr__(self, name):
+		if name.startswith('_'):
+			raise AttributeError(name)
+		return self[name]
+
+	def __getitem__(self, name):
+		if name not in self.databases:
+			self.databases[name] = FakeDatabase(name)
+		return self.databases[name]
+
+	def close(self):
+		pass
@@ -0,0 +1,163 @@
+import hashlib
+import html
+from collections import OrderedDict
+
+try:
+	import pygments.lexers
+	import pygments.token
+	import pygments.util
+except ImportError:
+	pygments = None
+
+'''
+Highlights code blocks when posts are rendered, so the page doesn't need
+highlight.js. The tokens get the same classes highlight.js would give them,
+so highlight.css still styles them. Blocks in languages pygments doesn't
+know are left for highlight.js, and so is everything if pygments isn't
+installed.
+
+Highlighted blocks are remembered by their language and the hash of their
+code, since rendering a post again (editing it, previews, backfills) mostly
+highlights the same blocks.
+'''
+
+# the most specific token type is looked up first, then its parents
+token_classes = {}
+if pygments is not None:
+	token = pygments.token
+	token_classes = {
+		token.Comment: 'hljs-comment',
+		token.Comment.Preproc: 'hljs-meta',
+		token.Comment.PreprocFile: 'hljs-string',
+		token.Keyword: 'hljs-keyword',
+		token.Keyword.Constant: 'hljs-literal',
+		token.Keyword.Type: 'hljs-type',
+		token.Name.Builtin: 'hljs-built_in',
+		token.Name.Class: 'hljs-title',
+		token.Name.Function: 'hljs-title',
+		token.Name.Decorator: 'hljs-meta',
+		token.Name.Tag: 'hljs-name',
+		token.Name.Attribute: 'hljs-attr',
+		token.Name.Variable: 'hljs-variable',
+		token.Name.Constant: 'hljs-variable',
+		token.Name.Label: 'hljs-symbol',
+		token.Name.Namespace: 'hljs-title',
+		token.String: 'hljs-string',
+		token.String.Escape: 'hljs-subst',
+		token.String.Interpol: 'hljs-subst',
+		token.String.Regex: 'hljs-regexp',
+		token.String.Symbol: 'hljs-symbol',
+		token.Number: 'hljs-number',
+		token.Operator.Word: 'hljs-keyword',
+		token.Generic.Deleted: 'hljs-deletion',
+		token.Generic.Inserted: 'hljs-addition',
+		token.Generic.Heading: 'hljs-section',
+		token.Generic.Subheading: 'hljs-section',
+		token.Generic.Emph: 'hljs-emphasis',
+		token.Generic.Strong: 'hljs-strong',
+		token.Generic.Prompt: 'hljs-meta',
+	}
+
+# highlighting is much slower than the rest of markdown, so longer blocks
+# and code after this much in a post are left for highlight.js
+max_length = 10000
+max_post_length = 20000
+# about how many times slower a character of highlighted code is to render
+# than a character of markdown, for deciding where posts are rendered
+cost_factor = 30
+
+# how many highlighted blocks are remembered, and how many characters of
+# html they can add up to
+max_cached = 1000
+max_cached_size = 8 * 1024 * 1024
+
+
+class cache:
+	# {(lang, sha1 of the code): html, or None if it couldn't be highlighted}
+	blocks = OrderedDict()
+	size = 0
+	# {lang: lexer, or None if pygments doesn't know it}
+	lexers = {}
+	# {token type: class}
+	classes = {}
+	hits = 0
+	misses = 0
+
+def get_lexer(lang):
+	if lang not in cache.lexers:
+		try:
+			# the newlines are kept, since markdown turns every one into a <br>
+			cache.lexers[lang] = pygments.lexers.get_lexer_by_name(lang, stripnl=False, ensurenl=False)
+		except pygments.util.ClassNotFound:
+			cache.lexers[lang] = None
+	return cache.lexers[lang]
+
+def get_class(token_type):
+	if token_type not in cache.classes:
+		t = token_type
+		while t not in token_classes and t.parent is not None:
+			t = t.parent
+		cache.classes[token_type] = token_classes.get(t)
+	return cache.classes[token_type]
+
+def highlight_tokens(lexer, code):
+	output = []
+	# tokens next to each other with the same class share a span
+	span_class = None
+	span_values = []
+	for token_type, value in lexer.get_tokens(code):
+		class_name = get_class(token_type)
+		if class_name != span_class:
+			output.append(render_span(span_class, span_values))
+			span_class = class_name
+			span_values = []
+		span_values.append(value)
+	output.append(render_span(span_class, span_values))
+	return ''.join(output)
+
+def render_span(class_name, values):
+	text = html.escape(''.join(values), quote=False)
+	if class_name is None or not text:
+		return text
+	return f'<span class="{class_name}">{text}</span>'
+
+def highlight(lang, code):
+	'''
+	Returns the code highlighted as html, or None if it can't be
+	'''
+	if pygments is None or not lang or len(code) > max_length:
+		return None
+	key = (lang, hashlib.sha1(code.encode()).digest())
+	if key in cache.blocks:
+		cache.hits += 1
+		cache.blocks.move_to_end(key)
+		return cache.blocks[key]
+	cache.misses += 1
+	lexer = get_lexer(lang.lower())
+	highlighted = None if lexer is None else highlight_tokens(lexer, code)
+	cache.blocks[key] = highlighted
+	cache.size += len(highlighted or '')
+	while len(cache.blocks) > max_cached or cache.size > max_cached_size:
+		_, removed = cache.blocks.popitem(last=False)
+		cache.size -= len(removed or '')
+	return highlighted
+
+def render_cost(content):
+	'''
+	Returns about how many characters of markdown rendering the content
+	costs as much as, counting the code that could be highlighted
+	'''
+	if pygments is None or '```' not in content:
+		return len(content)
+	return len(content) + min(len(content), max_post_length) * cost_factor
+
+def clear():
+	cache.blocks.clear()
+	cache.size = 0
+
+def stats():
+	return {
+		'hits': cache.hits,
+		'misses': cache.misses,
+		'blocks': len(cache.blocks),
+	}
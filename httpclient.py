@@ -0,0 +1,40 @@
+import aiohttp
+
+'''
+The aiohttp session that every outbound request uses, so connections,
+dns lookups and tls sessions are reused instead of made for every call
+'''
+
+pool_size = 100
+pool_size_per_host = 20
+dns_cache_seconds = 300
+timeout = aiohttp.ClientTimeout(total=15, connect=5, sock_read=10)
+
+class client:
+	session = None
+
+def create_session():
+	connector = aiohttp.TCPConnector(
+		limit=pool_size,
+		limit_per_host=pool_size_per_host,
+		use_dns_cache=True,
+		ttl_dns_cache=dns_cache_seconds,
+	)
+	return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+def get_session():
+	'''
+	Returns the shared session, creating it if it wasn't by start (e.g. when
+	database.py is used from a script)
+	'''
+	if client.session is None or client.session.closed:
+		client.session = create_session()
+	return client.session
+
+async def start(app=None):
+	get_session()
+
+async def close(app=None):
+	if client.session is not None:
+		await client.session.close()
+		client.session = None
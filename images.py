@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import sys
+
+try:
+	from PIL import Image, features
+except ImportError:
+	Image = None
+
+'''
+Smaller copies of the images in website/images, in more widths and better
+formats (webp, and avif if pillow supports it), so browsers can download
+the smallest one that's big enough instead of the full size png. They're
+made when the server starts and kept in website/images/variants, named by
+the hash of the image they're from so they're only made again when it
+changes, and can be cached forever. Their sizes are kept in manifest.json
+there.
+
+Stored posts only have the original images, the variants are added when
+a post is shown (markdown.add_image_variants) so pages never link to
+variants that were removed.
+
+This needs pillow, without it images are shown as they are.
+
+python3 images.py
+'''
+
+images_dir = os.path.join('website', 'images')
+variants_dir = os.path.join(images_dir, 'variants')
+manifest_path = os.path.join(variants_dir, 'manifest.json')
+# where the variants are on the site
+variants_url = '/images/variants/'
+
+# change this when the variants would be made differently
+version = 1
+
+widths = (320, 640, 960, 1280, 1920)
+source_extensions = {'.png', '.jpg', '.jpeg'}
+# (format, extension, content type, pillow save options), in the order
+# browsers should prefer them
+all_formats = [
+	('AVIF', 'avif', 'image/avif', {'quality': 60, 'speed': 6}),
+	# method 6 is only a few percent smaller and can be 50x slower
+	('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+]
+if Image is None:
+	formats = []
+else:
+	formats = [f for f in all_formats if features.check(f[0].lower())]
+
+# how wide images are shown, so the browser can choose a variant before
+# the page's css has loaded
+sizes = '(max-width: 800px) 100vw, 800px'
+
+# images can be linked to with the full url too
+site_urls = ('https://matdoes.dev', 'https://www.matdoes.dev')
+
+
+class manifest:
+	# {'/images/name.png': {'hash', 'width', 'height', 'variants': {content type: [[width, url], ...]}}}
+	images = {}
+
+def load_manifest():
+	try:
+		with open(manifest_path) as f:
+			data = json.load(f)
+	except (OSError, ValueError):
+		return
+	if data.get('version') == version:
+		manifest.images = data['images']
+
+def get_image(src):
+	'''
+	Returns the manifest entry for an image url, or None if it doesn't have
+	one
+	'''
+	for site_url in site_urls:
+		if src.startswith(site_url + '/'):
+			src = src[len(site_url):]
+			break
+	return manifest.images.get(src)
+
+
+def hash_file(path):
+	with open(path, 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+def make_variants(path, digest):
+	'''
+	Writes the variants of the image at path, returns its manifest entry
+	'''
+	original_size = os.path.getsize(path)
+	with Image.open(path) as image:
+		image.load()
+	width, height = image.size
+	has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+	image = image.convert('RGBA' if has_alpha else 'RGB')
+
+	variant_widths = [w for w in widths if w < width] + [width]
+	variants = {}
+	for pillow_format, extension, content_type, options in formats:
+		urls = []
+		for variant_width in variant_widths:
+			variant_height = max(1, round(height * variant_width / width))
+			if variant_width == width:
+				resized = image
+			else:
+				resized = image.resize((variant_width, variant_height), Image.LANCZOS)
+			filename = f'{digest[:16]}-{version}-{variant_width}.{extension}'
+			variant_path = os.path.join(variants_dir, filename)
+			resized.save(variant_path, pillow_format, **options)
+			# the original is better if it's smaller than this
+			if variant_width == width and os.path.getsize(variant_path) >= original_size:
+				os.remove(variant_path)
+				continue
+			urls.append([variant_width, variants_url + filename])
+		if urls:
+			variants[content_type] = urls
+	return {'hash': digest, 'width': width, 'height': height, 'variants': variants}
+
+def build_variants():
+	'''
+	Makes the variants of every image that changed since they were last
+	made, and removes the ones of images that don't exist anymore. Returns
+	how many images had variants made.
+	'''
+	if not os.path.isdir(images_dir):
+		return 0
+	os.makedirs(variants_dir, exist_ok=True)
+	load_manifest()
+	images = {}
+	made = 0
+	for filename in sorted(os.listdir(images_dir)):
+		path = os.path.join(images_dir, filename)
+		if not os.path.isfile(path) or os.path.splitext(filename)[1].lower() not in source_extensions:
+			continue
+		url = '/images/' + filename
+		digest = hash_file(path)
+		entry = manifest.images.get(url)
+		if entry is None or entry['hash'] != digest or not all(
+			os.path.exists(os.path.join(variants_dir, variant_url.rsplit('/', 1)[1]))
+			for urls in entry['variants'].values() for _, variant_url in urls
+		):
+			if Image is None:
+				continue
+			entry = make_variants(path, digest)
+			made += 1
+		images[url] = entry
+
+	used = {
+		variant_url.rsplit('/', 1)[1]
+		for entry in images.values() for urls in entry['variants'].values() for _, variant_url in urls
+	}
+	for filename in os.listdir(variants_dir):
+		# the manifest's compressed copies are made by precompress
+		if filename not in used and not filename.startswith('manifest.json'):
+			os.remove(os.path.join(variants_dir, filename))
+
+	manifest.images = images
+	with open(manifest_path, 'w') as f:
+		json.dump({'version': version, 'images': images}, f)
+	return made
+
+
+load_manifest()
+
+if __name__ == '__main__':
+	if Image is None:
+		print('pillow isn\'t installed, so variants can\'t be made')
+		sys.exit(1)
+	print('Made variants of', build_variants(), 'images in', ', '.join(f[1] for f in formats))
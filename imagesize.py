@@ -0,0 +1,90 @@
+import struct
+
+'''
+Reads the width and height of PNG, JPEG, GIF and WebP images from the
+start of the file, so only the first few bytes have to be downloaded
+'''
+
+# JPEGs can have a lot of metadata before the size, anything after this
+# many bytes isn't looked at
+max_header_size = 64 * 1024
+
+# start of frame markers, these are the ones that have the size
+jpeg_sof_markers = set(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+
+
+class ImageSizeError(ValueError):
+	pass
+
+
+def get_png_size(data):
+	if len(data) < 24:
+		return None
+	width, height = struct.unpack('>LL', data[16:24])
+	return width, height
+
+def get_gif_size(data):
+	if len(data) < 10:
+		return None
+	width, height = struct.unpack('<HH', data[6:10])
+	return width, height
+
+def get_webp_size(data):
+	if len(data) < 30:
+		return None
+	chunk_type = data[12:16]
+	if chunk_type == b'VP8 ':
+		width, height = struct.unpack('<HH', data[26:30])
+		return width & 0x3fff, height & 0x3fff
+	if chunk_type == b'VP8L':
+		bits = int.from_bytes(data[21:25], 'little')
+		return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+	if chunk_type == b'VP8X':
+		width = int.from_bytes(data[24:27], 'little') + 1
+		height = int.from_bytes(data[27:30], 'little') + 1
+		return width, height
+	raise ImageSizeError(f'Unknown WebP chunk {chunk_type!r}')
+
+def get_jpeg_size(data):
+	pos = 2
+	while True:
+		# markers can be padded with any number of 0xff
+		while pos < len(data) and data[pos] == 0xff:
+			pos += 1
+		if pos + 1 > len(data):
+			return None
+		marker = data[pos]
+		pos += 1
+		if marker == 0x01 or 0xd0 <= marker <= 0xd9:
+			# these don't have a length
+			continue
+		if pos + 2 > len(data):
+			return None
+		length, = struct.unpack('>H', data[pos:pos + 2])
+		if marker in jpeg_sof_markers:
+			if pos + 7 > len(data):
+				return None
+			height, width = struct.unpack('>HH', data[pos + 3:pos + 7])
+			return width, height
+		pos += length
+
+def get_image_size(data):
+	'''
+	Returns the (width, height) of the image that data is the start of, None
+	if more of the image is needed to know, or raises ImageSizeError if it
+	isn't a supported image
+	'''
+	if data[:8] == b'\x89PNG\r\n\x1a\n':
+		return get_png_size(data)
+	if data[:6] in {b'GIF87a', b'GIF89a'}:
+		return get_gif_size(data)
+	if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+		return get_webp_size(data)
+	if data[:2] == b'\xff\xd8':
+		size = get_jpeg_size(data)
+		if size is None and len(data) >= max_header_size:
+			raise ImageSizeError('JPEG size not found in header')
+		return size
+	if len(data) < 12:
+		return None
+	raise ImageSizeError('Unknown image format')
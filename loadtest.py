@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+import math
+import multiprocessing
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import aiohttp
+
+'''
+Load test for the whole app: the server is started in another process with
+an in-memory database full of generated posts and stub files instead of the
+cdn, and then a mix of routes is requested as fast as possible at a fixed
+concurrency. Each route is tested alone and then all of them together, and
+the throughput, latency percentiles and memory of the server are printed.
+
+python loadtest.py --concurrency 50 --duration 10
+python loadtest.py --mix "/=1,post=5,404=1" --no-page-cache
+python loadtest.py --workers 4 --mixed-only
+'''
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+default_mix = '/=2,/blog=2,post=4,/rss=1,404=1'
+
+# the status each route should respond with
+expected_status = {
+	'404': 404,
+}
+
+
+def serve(port, post_count, page_cache, worker_count):
+	'''
+	Runs the app on port, this is the server process
+	'''
+	os.chdir(repo_dir)
+	# the server's log events are still written, they just aren't mixed in
+	# with the results
+	sys.stdout = open(os.devnull, 'w')
+	import benchmark
+	import main
+	from aiohttp import web
+
+	# roughly the size of the real css and js, so pages are realistic
+	stub_dir = tempfile.mkdtemp(prefix='loadurls-')
+	for url in main.find_loadurls():
+		parsed = main.urllib.parse.urlparse(url)
+		path = os.path.join(stub_dir, parsed.netloc + parsed.path)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, 'w') as f:
+			f.write(f'/* stub for {url} */\n' + 'a{color:red}\n' * 2000)
+	main.loadurl_dir = stub_dir
+	# the seeded posts shouldn't be saved over a real search index
+	main.search_snapshot = os.path.join(stub_dir, 'search_index.json')
+
+	if not page_cache:
+		main.page_cache.max_entries = 0
+
+	async def seed(app=None):
+		main.db.connect()
+		await benchmark.seed_database(benchmark.make_corpus(), count=post_count)
+
+	if worker_count == 1:
+		app = main.create_app()
+		app.on_startup.insert(0, seed)
+		web.run_app(app, host='127.0.0.1', port=port, print=None)
+		return
+
+	async def warm():
+		await seed()
+		await main.warm_before_fork()
+
+	main.workers.run(main.create_app, warm, '127.0.0.1', port, worker_count)
+
+
+def get_rss(pid):
+	'''
+	Returns the resident memory of a process and its children in bytes, or
+	None if it can't be read (it's only on linux). With workers, memory
+	that's shared between them is counted once for each.
+	'''
+	try:
+		with open(f'/proc/{pid}/status', 'r') as f:
+			rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+		with open(f'/proc/{pid}/task/{pid}/children', 'r') as f:
+			children = [int(child) for child in f.read().split()]
+	except (OSError, StopIteration):
+		return None
+	for child in children:
+		rss += get_rss(child) or 0
+	return rss
+
+def percentile(sorted_values, p):
+	if not sorted_values:
+		return 0
+	index = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+	return sorted_values[index]
+
+def parse_mix(mix):
+	routes = {}
+	for item in mix.split(','):
+		# routes can have = in their query string, so the weight is after the last one
+		route, _, weight = item.strip().rpartition('=')
+		try:
+			routes[route] = float(weight)
+		except ValueError:
+			routes[item.strip()] = 1
+	return routes
+
+
+class Stats:
+	def __init__(self):
+		self.latencies = {}
+		self.errors = {}
+
+	def record(self, route, latency, ok):
+		self.latencies.setdefault(route, []).append(latency)
+		if not ok:
+			self.errors[route] = self.errors.get(route, 0) + 1
+
+
+def make_chooser(mix, slugs):
+	routes = list(mix)
+	weights = [mix[route] for route in routes]
+	rand = random.Random(3)
+
+	def choose():
+		route = rand.choices(routes, weights)[0]
+		if route == 'post':
+			return route, '/blog/post/' + rand.choice(slugs)
+		if route == '404':
+			return route, f'/{rand.choice(["wp-login.php", "admin", ".env", "blog/post/nope"])}{rand.randint(0, 99)}'
+		return route, route
+	return choose
+
+async def worker(session, base_url, choose, stats, deadline):
+	while time.perf_counter() < deadline:
+		route, path = choose()
+		start = time.perf_counter()
+		try:
+			async with session.get(base_url + path, allow_redirects=False) as r:
+				await r.read()
+				ok = r.status == expected_status.get(route, 200)
+		except (aiohttp.ClientError, asyncio.TimeoutError):
+			ok = False
+		stats.record(route, time.perf_counter() - start, ok)
+
+async def run_phase(name, mix, slugs, args, server_pid):
+	base_url = f'http://127.0.0.1:{args.port}'
+	stats = Stats()
+	choose = make_chooser(mix, slugs)
+	connector = aiohttp.TCPConnector(limit=args.concurrency)
+	headers = {'Accept-Encoding': 'gzip, br'}
+	rss_start = get_rss(server_pid)
+	rss_peak = rss_start or 0
+	async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+		start = time.perf_counter()
+		deadline = start + args.duration
+		workers = [
+			asyncio.ensure_future(worker(session, base_url, choose, stats, deadline))
+			for _ in range(args.concurrency)
+		]
+		while not all(w.done() for w in workers):
+			await asyncio.sleep(0.2)
+			rss_peak = max(rss_peak, get_rss(server_pid) or 0)
+		await asyncio.gather(*workers)
+		elapsed = time.perf_counter() - start
+	rss_end = get_rss(server_pid)
+	print_phase(name, stats, elapsed, rss_start, rss_end, rss_peak)
+
+def format_mb(value):
+	return f'{value / 1024 / 1024:.1f}MB' if value else '-'
+
+def print_phase(name, stats, elapsed, rss_start, rss_end, rss_peak):
+	print()
+	print(f'{name}: memory {format_mb(rss_start)} -> {format_mb(rss_end)} (peak {format_mb(rss_peak)})')
+	width = max([10] + [len(route) for route in stats.latencies])
+	print(f'{"route":<{width}} {"requests":>9} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"errors":>7}')
+	total = 0
+	for route, latencies in stats.latencies.items():
+		latencies.sort()
+		total += len(latencies)
+		print(
+			f'{route:<{width}} {len(latencies):>9} {len(latencies) / elapsed:>9.1f}'
+			f' {percentile(latencies, 50) * 1000:>9.2f} {percentile(latencies, 95) * 1000:>9.2f}'
+			f' {percentile(latencies, 99) * 1000:>9.2f} {stats.errors.get(route, 0):>7}'
+		)
+	print(f'{"total":<{width}} {total:>9} {total / elapsed:>9.1f}')
+
+async def wait_for_server(port, timeout=60):
+	deadline = time.perf_counter() + timeout
+	async with aiohttp.ClientSession() as session:
+		while time.perf_counter() < deadline:
+			try:
+				async with session.get(f'http://127.0.0.1:{port}/sitemap.xml') as r:
+					if r.status == 200:
+						return await r.text()
+			except aiohttp.ClientError:
+				pass
+			await asyncio.sleep(0.2)
+	raise TimeoutError('The server didn\'t start')
+
+async def run(args, server_pid):
+	sitemap = await wait_for_server(args.port)
+	slugs = re.findall(r'/blog/post/([^<]+)</loc>', sitemap)
+	mix = parse_mix(args.mix)
+	print(f'{len(slugs)} posts, {args.workers} workers, {args.concurrency} concurrent requests, {args.duration}s per phase')
+	if not args.mixed_only:
+		for route in mix:
+			await run_phase(route, {route: 1}, slugs, args, server_pid)
+	await run_phase('mixed', mix, slugs, args, server_pid)
+
+def main():
+	parser = argparse.ArgumentParser(description='Load test for the app')
+	parser.add_argument('--concurrency', type=int, default=50, help='how many requests are made at once')
+	parser.add_argument('--duration', type=float, default=5, help='seconds to run each phase for')
+	parser.add_argument('--mix', default=default_mix, help='routes and how often they\'re requested: post, 404, or any path like /blog/search?q=python=2')
+	parser.add_argument('--posts', type=int, default=40, help='how many posts to make')
+	parser.add_argument('--port', type=int, default=8089)
+	parser.add_argument('--no-page-cache', action='store_true', help='render every page instead of using the page cache')
+	parser.add_argument('--mixed-only', action='store_true', help='only test all the routes together')
+	parser.add_argument('--workers', type=int, default=1, help='how many server processes to run')
+	args = parser.parse_args()
+
+	server = multiprocessing.Process(
+		target=serve, args=(args.port, args.posts, not args.no_page_cache, args.workers)
+	)
+	server.start()
+	try:
+		asyncio.run(run(args, server.pid))
+	finally:
+		server.terminate()
+		server.join()
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
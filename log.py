@@ -0,0 +1,167 @@
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+'''
+Structured logging that never waits for stdout. Events are put in a queue
+and written by a background thread, so a slow pipe or terminal can't block
+the event loop. Every event has a name and fields, and the id of the
+request it happened in:
+
+log.info('post created', slug=slug)
+
+Debug events cost almost nothing when the level is higher, since they're
+thrown away before anything is formatted. The level is set with the
+log_level env var and can be changed while the server is running with
+set_level. log_format can be text (the default) or json.
+'''
+
+levels = {
+	'debug': logging.DEBUG,
+	'info': logging.INFO,
+	'warning': logging.WARNING,
+	'error': logging.ERROR,
+}
+
+# events are dropped instead of waiting when this many haven't been written
+max_queued = 10000
+
+# the id of the request that's being handled, set by start_request
+request_id = contextvars.ContextVar('request_id', default=None)
+request_ids = itertools.count(1)
+
+logger = logging.getLogger('matdoesdev')
+logger.propagate = False
+
+
+class TextFormatter(logging.Formatter):
+	def format(self, record):
+		timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created))
+		parts = [f'{timestamp}.{int(record.msecs):03d}', record.levelname]
+		if record.request_id is not None:
+			parts.append(f'[{record.request_id}]')
+		parts.append(record.getMessage())
+		for key, value in record.fields.items():
+			parts.append(f'{key}={value!r}' if isinstance(value, str) and ' ' in value else f'{key}={value}')
+		if record.exc_info:
+			parts.append('\n' + self.formatException(record.exc_info))
+		return ' '.join(parts)
+
+class JsonFormatter(logging.Formatter):
+	def format(self, record):
+		data = {
+			'time': record.created,
+			'level': record.levelname.lower(),
+			'event': record.getMessage(),
+		}
+		if record.request_id is not None:
+			data['request_id'] = record.request_id
+		data.update(record.fields)
+		if record.exc_info:
+			data['exception'] = self.formatException(record.exc_info)
+		return json.dumps(data, default=str)
+
+
+class StdoutHandler(logging.StreamHandler):
+	def emit(self, record):
+		# looked up every time, so redirecting stdout still works
+		self.stream = sys.stdout
+		super().emit(record)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+	def __init__(self, event_queue):
+		super().__init__(event_queue)
+		self.dropped = 0
+
+	def prepare(self, record):
+		# formatting is left to the thread, the default prepare does it here
+		return record
+
+	def enqueue(self, record):
+		try:
+			self.queue.put_nowait(record)
+		except queue.Full:
+			self.dropped += 1
+
+
+class state:
+	handler = None
+	listener = None
+
+def start():
+	'''
+	Starts the thread that writes the events, this is done when the module
+	is imported and again in forked processes since threads don't survive
+	forking
+	'''
+	formatter = JsonFormatter() if os.getenv('log_format') == 'json' else TextFormatter()
+	output = StdoutHandler()
+	output.setFormatter(formatter)
+	event_queue = queue.Queue(max_queued)
+	if state.handler is not None:
+		logger.removeHandler(state.handler)
+	state.handler = DroppingQueueHandler(event_queue)
+	logger.addHandler(state.handler)
+	state.listener = logging.handlers.QueueListener(event_queue, output)
+	state.listener.start()
+
+def close():
+	'''
+	Writes the events that are still queued and stops the thread
+	'''
+	if state.listener is not None:
+		state.listener.stop()
+		state.listener = None
+
+def set_level(level):
+	'''
+	Sets the lowest level of events that are written, raises ValueError if
+	it isn't one of levels
+	'''
+	if level not in levels:
+		raise ValueError(f'Unknown log level {level!r}')
+	logger.setLevel(levels[level])
+
+def get_level():
+	return logging.getLevelName(logger.getEffectiveLevel()).lower()
+
+def get_dropped():
+	return state.handler.dropped if state.handler is not None else 0
+
+
+def start_request(incoming_id=None):
+	'''
+	Sets the id that's logged with everything in this request, returns it
+	'''
+	rid = incoming_id or f'{os.getpid():x}-{next(request_ids):x}'
+	request_id.set(rid)
+	return rid
+
+def log(level, event, fields, exc_info=None):
+	if logger.isEnabledFor(level):
+		logger.log(level, event, exc_info=exc_info, extra={'fields': fields, 'request_id': request_id.get()})
+
+def debug(event, **fields):
+	log(logging.DEBUG, event, fields)
+
+def info(event, **fields):
+	log(logging.INFO, event, fields)
+
+def warning(event, **fields):
+	log(logging.WARNING, event, fields)
+
+def error(event, exc_info=None, **fields):
+	log(logging.ERROR, event, fields, exc_info=exc_info)
+
+
+set_level(os.getenv('log_level', 'info'))
+start()
+atexit.register(close)
+os.register_at_fork(after_in_child=start)
@@ -1,4 +1,7 @@
-import setup
+import time
+# how long starting takes is measured from when main is first imported
+import_start = time.perf_counter()
+
 import aiohttp
 import database as db
 from aiohttp import web
@@ -7,23 +10,105 @@ from jinja2 import Environment, select_autoescape
 import json
 import re
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 import asyncio
 import markdown
+import pagecache
+import compression
+import httpclient
+import workers
+import metrics
+import renderpool
+import search
+import log
+import scanners
+import images
+import highlight
+import admission
+import http
+from timeago import timeago
+import urllib.parse
+from yarl import URL
+
+loadurl_pattern = re.compile(r'<< loadurl (.+?) >>')
+
+# files in here are used instead of downloading loadurls, e.g.
+# assets/cdn.matdoes.dev/main.css for https://cdn.matdoes.dev/main.css
+loadurl_dir = 'assets'
+
+class loadurls:
+	contents = {}
+	pending = {}
+	template_urls = None
+
+def find_loadurls():
+	'''
+	Returns every url that's loaded with << loadurl >> in the templates
+	'''
+	if loadurls.template_urls is None:
+		urls = set()
+		for filename in os.listdir('templates'):
+			with open(os.path.join('templates', filename), 'r') as f:
+				urls.update(loadurl_pattern.findall(f.read()))
+		loadurls.template_urls = urls
+	return loadurls.template_urls
+
+async def fetch_loadurl(url):
+	parsed_url = urllib.parse.urlparse(url)
+	local_path = os.path.join(loadurl_dir, parsed_url.netloc + parsed_url.path)
+	if os.path.isfile(local_path):
+		with open(local_path, 'r') as f:
+			return f.read()
+	log.info('downloading loadurl', url=url)
+	async with httpclient.get_session().get(url) as resp:
+		resp.raise_for_status()
+		return await resp.text()
+
+async def load_url(url):
+	'''
+	Downloads a loadurl if it hasn't been already, requests for a url that's
+	already being downloaded wait for the same download
+	'''
+	if url in loadurls.contents:
+		return loadurls.contents[url]
+	task = loadurls.pending.get(url)
+	if task is None:
+		task = asyncio.ensure_future(fetch_loadurl(url))
+		loadurls.pending[url] = task
+		task.add_done_callback(lambda _: loadurls.pending.pop(url, None))
+	content = await asyncio.shield(task)
+	loadurls.contents[url] = content
+	return content
+
+async def load_urls():
+	await asyncio.gather(*(load_url(url) for url in find_loadurls()))
+
+def inline_loadurls(contents):
+	def replace(m):
+		content = loadurls.contents[m.group(1)]
+		return '{% raw %}' + content + '{% endraw %}'
+	return loadurl_pattern.sub(replace, contents)
 
 class CachingFileSystemLoader(jinja2.BaseLoader):
+	'''
+	Loads templates from templates/ with their << loadurl >>s already
+	replaced, so load_urls has to be done before any template is loaded
+	'''
 	def __init__(self):
 		self.file_cache = {}
 		self.template_list = None
+		self.searchpath = ['templates']
+		self.followlinks = False
 
 	def get_source(self, environment, template):
 		filename = 'templates/' + template
 		if filename in self.file_cache:
 			contents = self.file_cache[filename]
 		else:
-			print('Opening', filename)
+			log.debug('opening template', filename=filename)
 			with open(filename, 'r') as f:
 				contents = f.read()
+			contents = inline_loadurls(contents)
 			self.file_cache[filename] = contents
 
 		return contents, filename, lambda: False
@@ -69,42 +154,109 @@ class templates:
 	cached_responses = {}
 
 async def load_template(filename, url=None, static=False, **kwargs):
+	kwargs['url'] = url
 	if filename in templates.template_dict:
 		t = templates.template_dict[filename]
-		r = await t.render_async(**kwargs)
 	else:
-		print(f'Loading template {filename} for the first time')
+		log.debug('loading template', filename=filename)
+		await load_urls()
 		t = jinja_env.get_template(filename)
 		templates.template_dict[filename] = t
+	with metrics.timed('template'):
 		r = await t.render_async(**kwargs)
 	return r
 
 routes = web.RouteTableDef()
 
+page_cache = pagecache.PageCache()
+cached_handlers = set()
+
+def cached(handler):
+	'''
+	Marks a handler's page as cacheable for anonymous users, it has to be
+	invalidated with page_cache.invalidate when what it shows changes
+	'''
+	cached_handlers.add(handler)
+	return handler
+
+# the only query parameters cached pages use, the others don't change them
+page_params = ('before', 'after')
+
+def page_key(request):
+	'''
+	The page cache key of a request, its path and the query parameters
+	cached pages use. The host and other parameters aren't in it, so they
+	can't make more copies of the same page.
+	'''
+	query = [(name, request.query[name]) for name in page_params if name in request.query]
+	return str(URL.build(path=request.path, query=query))
+
+def page_url(request):
+	# cached pages are shown for every host and query with the same key, so
+	# their canonical url can't come from the request
+	return URL(db.base_url + page_key(request))
+
+def invalidate_post(slug):
+	page_cache.invalidate('/blog', '/rss', f'/blog/post/{slug}')
+	feed.last_modified = None
+
+def not_modified(request, etag, last_modified):
+	'''
+	Whether the client already has the version of the page with this etag
+	and last modified time, so it can be sent a 304
+	'''
+	if_none_match = request.headers.get('If-None-Match')
+	if if_none_match is not None:
+		if if_none_match.strip() == '*':
+			return True
+		# weak comparison, compressing the page doesn't change what it is
+		tags = {tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')}
+		return etag is not None and etag.replace('W/', '', 1) in tags
+	if_modified_since = request.if_modified_since
+	if if_modified_since is None or last_modified is None:
+		return False
+	return last_modified.replace(microsecond=0) <= if_modified_since
+
+def set_validators(r, etag, last_modified):
+	if etag is not None:
+		r.headers['ETag'] = etag
+	if last_modified is not None:
+		r.last_modified = last_modified
+	return r
 
 
 @routes.get('/')
+@cached
 async def index(request):
-	return await load_template('index.html', static=True)
+	return await load_template('index.html', url=page_url(request), static=True)
 
-projects_dict = json.loads(open('website/projects.json', 'r').read())
+class projects_file:
+	projects = []
+
+def load_projects():
+	with open('website/projects.json', 'r') as f:
+		projects_file.projects = json.load(f)
 
 #@routes.get('/projects')
 #async def projects(request):
 #	return web.Response(text='<h1>Coming soon</h1>', content_type='text/html')
 
 @routes.get('/projects')
+@cached
 async def projects(request):
-	return await load_template('projects.html', projects=projects_dict)
+	return await load_template('projects.html', url=page_url(request), projects=projects_file.projects)
+
+def sitemap_lastmod(lastmod_time):
+	return datetime.strftime(lastmod_time, '%Y-%m-%dT%H:%M:%SZ')
 
 sitemap_dict = {
 	'/': {
 		'priority': 1.0,
-		'lastmod': datetime.strftime(datetime.now(), '%Y-%m-%dT%H:%I:%SZ')
+		'lastmod': sitemap_lastmod(datetime.now())
 	},
 	'/projects': {
 		'priority': 0.8,
-		'lastmod': datetime.strftime(datetime.now(), '%Y-%m-%dT%H:%I:%SZ')
+		'lastmod': sitemap_lastmod(datetime.now())
 
 	},
 	'/blog': {
@@ -113,41 +265,200 @@ sitemap_dict = {
 	}
 }
 
+# the most urls a sitemap can have, after this it's split into multiple
+# sitemaps that are listed in /sitemap.xml
+sitemap_max_urls = 50000
+
+def get_sitemap_pages():
+	paths = list(sitemap_dict)
+	return [
+		{path: sitemap_dict[path] for path in paths[i:i + sitemap_max_urls]}
+		for i in range(0, len(paths), sitemap_max_urls)
+	]
+
+def invalidate_sitemap():
+	page_count = len(sitemap_dict) // sitemap_max_urls + 2
+	page_cache.invalidate('/sitemap.xml', *(f'/sitemap-{i}.xml' for i in range(1, page_count)))
+
+def load_sitemap(posts):
+	for b in posts:
+		set_sitemap_post(b)
+	invalidate_sitemap()
+
+def set_sitemap_post(post):
+	path = '/blog/post/' + post['slug']
+	if post['hidden']:
+		sitemap_dict.pop(path, None)
+		return
+	sitemap_dict[path] = {
+		'priority': 0.6,
+		'lastmod': sitemap_lastmod(post['edited_time'])
+	}
+
+search_index = search.SearchIndex()
+# the search index is saved here, so only the posts that changed since then
+# have to be indexed when the server starts
+search_snapshot = os.getenv('search_snapshot', 'search_index.json')
+
+async def save_search_index():
+	data = search_index.to_json()
+	try:
+		await asyncio.get_event_loop().run_in_executor(None, search.write_snapshot, search_snapshot, data)
+	except OSError as e:
+		log.warning('failed to save the search index', error=repr(e))
+
+async def load_search_index(posts):
+	loaded = search_index.load(search_snapshot)
+	changed = search_index.update(posts)
+	log.info('loaded search index', posts=len(search_index), changed=changed, from_snapshot=loaded)
+	if changed:
+		await save_search_index()
+
+async def reload_posts():
+	'''
+	Makes the sitemap and search index match the database. Workers are
+	forked with them as they were before the first fork, so one that
+	replaces a worker that died would miss every post changed since.
+	'''
+	posts = await db.get_blog_posts(get_hidden=True)
+	load_sitemap(posts)
+	changed = search_index.update(posts)
+	log.info('reloaded posts', posts=len(posts), changed=changed)
+
+async def post_changed(slug, publish=True):
+	'''
+	Updates everything that shows a post after it's created or edited, and
+	tells the other workers to do the same
+	'''
+	invalidate_post(slug)
+	post = await db.get_blog_post(slug)
+	if post is not None:
+		set_sitemap_post(post)
+		search_index.add(post)
+	invalidate_sitemap()
+	if publish:
+		workers.publish({'post_changed': slug})
+		# the other workers have the same index, only one has to save it
+		await save_search_index()
+
+async def on_worker_message(message):
+	if 'post_changed' in message:
+		await post_changed(message['post_changed'], publish=False)
+	if 'log_level' in message:
+		log.set_level(message['log_level'])
+
+# the sitemaps are only rendered when they change, after that they're
+# sent from the page cache (compressed if the crawler accepts it)
 @routes.get('/sitemap.xml')
+@cached
 async def sitemap(request):
-	return await load_template('sitemap.xml', sitemap=sitemap_dict)
+	pages = get_sitemap_pages()
+	if len(pages) <= 1:
+		return await load_template('sitemap.xml', url=page_url(request), sitemap=sitemap_dict)
+	sitemaps = [
+		{
+			'path': f'/sitemap-{i}.xml',
+			'lastmod': max(page[path]['lastmod'] for path in page)
+		}
+		for i, page in enumerate(pages, 1)
+	]
+	return await load_template('sitemapindex.xml', url=page_url(request), sitemaps=sitemaps)
+
+@routes.get(r'/sitemap-{page:\d+}.xml')
+@cached
+async def sitemap_page(request):
+	pages = get_sitemap_pages()
+	page = int(request.match_info['page'])
+	if len(pages) <= 1 or not 1 <= page <= len(pages):
+		raise web.HTTPNotFound()
+	return await load_template('sitemap.xml', url=page_url(request), sitemap=pages[page - 1])
 
 # @routes.get('/blog')
 # async def blog_soon(request):
 # 	return await load_template('soon.html')
 
 async def get_username(request):
-	cookies = request.cookies
-	sid = cookies.get('sid')
-	username = await db.get_session(sid)
+	if 'username' in request:
+		return request['username']
+	sid = request.cookies.get('sid')
+	# most visitors don't have a session, so don't bother looking it up
+	username = None if sid is None else await db.get_session(sid)
+	request['username'] = username
 	return username
 
 async def check_admin(request):
 	username = await get_username(request)
 	return username is not None
 
+def get_cursor(request, name):
+	cursor = request.query.get(name)
+	if cursor is None:
+		return None
+	try:
+		return db.decode_cursor(cursor)
+	except ValueError:
+		raise web.HTTPBadRequest()
+
 @routes.get('/blog')
+@cached
 async def blog(request):
 	is_admin = await check_admin(request)
-	posts = await db.get_blog_posts(limit=10, get_hidden=is_admin)
-	return await load_template('blog.html', posts=posts, is_admin=is_admin)
+	before = get_cursor(request, 'before')
+	after = get_cursor(request, 'after')
+	posts, newer, older = await db.get_blog_post_page(
+		10, get_hidden=is_admin, before=before, after=after
+	)
+	return await load_template('blog.html', url=page_url(request), posts=posts, is_admin=is_admin, newer=newer, older=older)
+
+@routes.get('/blog/search')
+async def blog_search(request):
+	is_admin = await check_admin(request)
+	query = request.query.get('q', '').strip()[:search.max_query_length]
+	with metrics.timed('search'):
+		results = search_index.search(query, get_hidden=is_admin)
+	for result in results:
+		result['timeago'] = timeago(result['datetime'])
+	return await load_template('search.html', url=request.url, query=query, results=results, is_admin=is_admin)
+
+# how many posts are in each page of the rss feed
+rss_size = 20
+
+class feed:
+	# when a post was last created or edited, None if it has to be gotten
+	# from the database again
+	last_modified = None
+
+async def get_feed_validators():
+	if feed.last_modified is None:
+		last_edited = await db.get_last_edited_time()
+		if last_edited is None:
+			return None, None
+		# posts are saved with datetime.now(), so this is in local time
+		feed.last_modified = last_edited.astimezone(timezone.utc)
+	etag = 'W/"' + feed.last_modified.strftime('%Y%m%d%H%M%S%f') + '"'
+	return etag, feed.last_modified
 
 @routes.get('/rss')
+@cached
 async def blog_rss(request):
-	posts = await db.get_blog_posts(get_html=True)
-	return await load_template('blog.xml', posts=posts)
+	etag, last_modified = await get_feed_validators()
+	if not_modified(request, etag, last_modified):
+		return set_validators(web.Response(status=304), etag, last_modified)
+	# older posts are in archive pages, linked from the feed
+	before = get_cursor(request, 'before')
+	posts, _, older = await db.get_blog_post_page(rss_size, get_html=True, before=before)
+	r = web.Response(
+		text=await load_template('blog.xml', url=page_url(request), posts=posts, older=older),
+		content_type='application/rss+xml'
+	)
+	return set_validators(r, etag, last_modified)
 
 @routes.get('/blog/new')
 async def blog_new(request):
 	username = await get_username(request)
 	if username is None:
 		return web.HTTPTemporaryRedirect('/blog/login')
-	return await load_template('editpost.html', username=username, new=True)
+	return await load_template('editpost.html', url=request.url, username=username, new=True)
 
 
 @routes.post('/blog/new')
@@ -158,10 +469,9 @@ async def blog_post_new(request):
 		return web.HTTPTemporaryRedirect('/blog/login')
 	body = form['body']
 	title = form['title']
-	print(form)
 	unlisted = form.get('unlisted', 'off') == 'on'
 	r = await db.new_blog_post(title, body, username, unlisted=unlisted)
-	print(r)
+	await post_changed(r)
 	return web.HTTPFound(f'/blog/post/{r}')
 
 @routes.post('/blog/edit')
@@ -175,7 +485,7 @@ async def blog_post_edit(request):
 	slug = form['slug']
 	unlisted = form.get('unlisted', 'off') == 'on'
 	slug = await db.edit_blog_post(title, body, username, slug=slug, unlisted=unlisted)
-	print('Unlisted:', unlisted)
+	await post_changed(slug)
 	if unlisted:
 		return web.HTTPFound(f'/blog/edit/{slug}')
 	else:
@@ -190,42 +500,136 @@ async def blog_post_preview(request):
 		return web.HTTPTemporaryRedirect('/blog/login')
 	body = form['body']
 	title = form['title']
-	post = db.get_blog_post_dict(title, body, username)
+	post = await db.get_blog_post_dict(title, body, username)
 	post = await db.convert_post(post, get_html=True)
-	return await load_template('blogpost.html', p=post, is_admin=False, is_preview=True)
+	return await load_template('blogpost.html', url=request.url, p=post, is_admin=False, is_preview=True)
+
+@routes.get('/blog/cache')
+async def cache_stats(request):
+	if not await check_admin(request):
+		raise web.HTTPNotFound()
+	return web.json_response(page_cache.stats())
+
+# whether /metrics and /blog/log-level work without logging in when the
+# request comes from localhost. it's off unless it's set, since a proxy
+# that doesn't set X-Forwarded-For makes every request look local
+trust_localhost = os.getenv('trust_localhost') == 'true'
+
+def is_local(request):
+	if not trust_localhost:
+		return False
+	# requests through cloudflare or a proxy come from it, not localhost
+	if 'Cf-Connecting-Ip' in request.headers or 'X-Forwarded-For' in request.headers:
+		return False
+	return request.remote in {'127.0.0.1', '::1'}
+
+@routes.get('/metrics')
+async def prometheus_metrics(request):
+	if not is_local(request) and not await check_admin(request):
+		raise web.HTTPNotFound()
+	return web.Response(text=metrics.render(), headers={
+		# the prometheus text format
+		'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'
+	})
+
+@routes.get('/blog/log-level')
+@routes.post('/blog/log-level')
+async def log_level(request):
+	'''
+	Shows the log level, or changes it (in every worker) when it's posted
+	with a level
+	'''
+	if not is_local(request) and not await check_admin(request):
+		raise web.HTTPNotFound()
+	if request.method == 'POST':
+		form = await request.post()
+		level = form.get('level', '').lower()
+		try:
+			log.set_level(level)
+		except ValueError as e:
+			raise web.HTTPBadRequest(reason=str(e))
+		workers.publish({'log_level': level})
+	return web.json_response({'level': log.get_level(), 'dropped': log.get_dropped()})
+
+def collect_cache_metrics():
+	page_stats = page_cache.stats()
+	session_stats = db.sessions.stats()
+	scanner_stats = scanner_tracker.stats()
+	admission_stats = {f'{method} {route}': limit.stats() for (method, route), limit in route_limits.items()}
+	highlight_stats = highlight.stats()
+	return {
+		'page_cache_requests_total': ('Anonymous page requests by whether they were cached', 'counter', {
+			(('result', 'hit'),): page_stats['hits'],
+			(('result', 'miss'),): page_stats['misses'],
+		}),
+		'page_cache_hit_ratio': ('Ratio of page requests that were cached', 'gauge', page_stats['hit_ratio']),
+		'page_cache_evictions_total': ('Pages removed from the cache to make space', 'counter', page_stats['evictions']),
+		'page_cache_invalidations_total': ('Pages removed from the cache because they changed', 'counter', page_stats['invalidations']),
+		'page_cache_pages': ('Pages in the cache', 'gauge', page_stats['pages']),
+		'page_cache_bytes': ('Size of the cached pages', 'gauge', page_stats['bytes']),
+		'session_cache_entries': ('Cached sessions', 'gauge', {
+			(('kind', 'session'),): session_stats['sessions'],
+			(('kind', 'negative'),): session_stats['negative'],
+		}),
+		'startup_seconds': ('How long the import and startup took', 'gauge', {
+			(('part', 'import'),): startup.import_time or 0,
+			(('part', 'startup'),): startup.startup_time or 0,
+		}),
+		'scanner_ips': ('Ips that are being sent minimal 404s for requesting too many pages that don\'t exist', 'gauge', scanner_stats['scanners']),
+		'scanners_flagged_total': ('Times an ip was found to be a scanner', 'counter', scanner_stats['flagged']),
+		'admission_rejected_total': ('Requests to limited routes that were rejected', 'counter', {
+			(('route', route), ('reason', reason)): count
+			for route, stats in admission_stats.items()
+			for reason, count in stats['shed'].items()
+		}),
+		'admission_in_flight': ('Requests to limited routes being handled', 'gauge', {
+			(('route', route),): stats['in_flight'] for route, stats in admission_stats.items()
+		}),
+		'admission_waiting': ('Requests to limited routes waiting to be handled', 'gauge', {
+			(('route', route),): stats['waiting'] for route, stats in admission_stats.items()
+		}),
+		'highlight_cache_requests_total': ('Code blocks highlighted by whether they were cached', 'counter', {
+			(('result', 'hit'),): highlight_stats['hits'],
+			(('result', 'miss'),): highlight_stats['misses'],
+		}),
+		'highlight_cache_blocks': ('Highlighted code blocks in the cache', 'gauge', highlight_stats['blocks']),
+		'log_events_dropped_total': ('Log events thrown away because too many were waiting to be written', 'counter', log.get_dropped()),
+	}
+
+metrics.collectors.append(collect_cache_metrics)
 
 @routes.get('/blog/login')
 async def blog_login(request):
-	return await load_template('login.html')
+	return await load_template('login.html', url=request.url)
 
 @routes.get('/blog/post/{slug}')
+@cached
 async def view_post(request):
 	post = await db.get_blog_post(request.match_info['slug'])
 	if post is None:
 		raise web.HTTPNotFound()
 	is_admin = await check_admin(request)
-	return await load_template('blogpost.html', p=post, is_admin=is_admin)
+	return await load_template('blogpost.html', url=page_url(request), p=post, is_admin=is_admin)
 
 @routes.get('/blog/edit/{slug}')
 async def edit_post(request):
 	post = await db.get_blog_post(request.match_info['slug'])
-	return await load_template('editpost.html', p=post, new=False)
+	return await load_template('editpost.html', url=request.url, p=post, new=False)
 
 @routes.post('/blog/login')
 async def blog_login_post(request):
 	form = await request.post()
-	async with aiohttp.ClientSession() as s:
-		r = await s.post(
-			'https://www.google.com/recaptcha/api/siteverify',
-			data={
-				'secret': os.getenv('recaptchasecret'),
-				'response': form['g-recaptcha-response'],
-				'remoteip': request.headers['Cf-Connecting-Ip']
-			}
-		)
+	async with httpclient.get_session().post(
+		'https://www.google.com/recaptcha/api/siteverify',
+		data={
+			'secret': os.getenv('recaptchasecret'),
+			'response': form['g-recaptcha-response'],
+			'remoteip': request.headers['Cf-Connecting-Ip']
+		}
+	) as r:
 		r = await r.json()
 	if not r['success']:
-		return await load_template('login.html')
+		return await load_template('login.html', url=request.url)
 	else:
 		if form['username'] == os.getenv('adminuser') and form['password'] == os.getenv('adminpassword'):
 			# ref = request.headers.get('Referer')
@@ -241,69 +645,252 @@ async def blog_login_post(request):
 			r = web.HTTPFound(ref)
 			sid = await db.new_session(form['username'])
 			r.set_cookie('sid', sid, max_age=31557600) # seconds in a year
-			print('good', ref)
+			log.info('logged in', username=form['username'], ref=ref)
 			return r
-	print('lol wrong password')
-	return await load_template('login.html')
+	log.warning('wrong password', username=form['username'])
+	return await load_template('login.html', url=request.url)
 
 
+def compress_response(request, r, get_encoded=None):
+	'''
+	Compresses the body of r with the best encoding the client accepts,
+	get_encoded is used to get the compressed body if it's given
+	'''
+	if len(r.body) < compression.min_size or not compression.is_compressible(r.content_type):
+		return r
+	r.headers['Vary'] = 'Accept-Encoding'
+	encoding = compression.choose_encoding(request.headers.get('Accept-Encoding', ''))
+	if encoding is None:
+		return r
+	with metrics.timed('compress'):
+		if get_encoded is None:
+			r.body = compression.compress(r.body, encoding)
+		else:
+			r.body = get_encoded(encoding)
+	r.headers['Content-Encoding'] = encoding
+	return r
+
+def cached_page_response(request, key, page):
+	r = web.Response(body=page.body, content_type=page.content_type, charset=page.charset)
+	return compress_response(request, r, lambda encoding: page_cache.get_encoded(key, page, encoding))
+
+def get_route_name(request):
+	route = request.match_info.route
+	if route.resource is None:
+		# not found or method not allowed
+		return 'unmatched'
+	if isinstance(route.resource, web.StaticResource):
+		return 'static'
+	return route.resource.canonical
+
+@web.middleware
+async def metrics_middleware(request, handler):
+	start = time.perf_counter()
+	timings = metrics.start_request()
+	# cloudflare's id for the request, so it can be found in both logs
+	request_id = log.start_request(request.headers.get('Cf-Ray', '')[:64])
+	status = 500
+	r = None
+	try:
+		r = await handler(request)
+		status = r.status
+		return r
+	except web.HTTPException as e:
+		status = e.status
+		r = e
+		raise
+	finally:
+		duration = time.perf_counter() - start
+		route = get_route_name(request)
+		server_timing = metrics.finish_request(route, status, duration, timings)
+		if r is not None and not getattr(r, 'prepared', False):
+			r.headers['Server-Timing'] = server_timing
+			r.headers['X-Request-Id'] = request_id
+		log.debug('request', method=request.method, path=request.path, route=route, status=status, ms=round(duration * 1000, 2))
+
+@web.middleware
+async def compression_middleware(request, handler):
+	r = await handler(request)
+	# static files are sent already compressed by aiohttp, from the .gz and
+	# .br files made by compression.precompress_directory
+	if type(r) is web.Response and isinstance(r.body, bytes) and 'Content-Encoding' not in r.headers:
+		compress_response(request, r)
+	return r
+
+@web.middleware
+async def cache_middleware(request, handler):
+	if request.method != 'GET' or request.match_info.handler not in cached_handlers:
+		return await handler(request)
+	# admins see hidden posts and edit buttons, so their pages aren't cached
+	if await check_admin(request):
+		return await handler(request)
+	key = page_key(request)
+	page = page_cache.get(key)
+	if page is not None:
+		if (page.etag or page.last_modified) and not_modified(request, page.etag, page.last_modified):
+			r = set_validators(web.Response(status=304), page.etag, page.last_modified)
+		else:
+			r = cached_page_response(request, key, page)
+		r.headers['X-Cache'] = 'HIT'
+		return r
+	r = await handler(request)
+	if r.status == 200 and isinstance(r.body, bytes):
+		page = pagecache.CachedPage(
+			request.path, r.body, r.content_type, r.charset,
+			etag=r.headers.get('ETag'), last_modified=r.last_modified
+		)
+		page_cache.set(key, page)
+		r = set_validators(cached_page_response(request, key, page), page.etag, page.last_modified)
+	r.headers['X-Cache'] = 'MISS'
+	return r
+
+class error_pages:
+	# {status: CachedPage} of the error pages with the usual message for
+	# their status, they're the same for everyone so they're only rendered
+	# and compressed once
+	pages = {}
+
+# the statuses that get their error page rendered at startup, the others
+# are rendered the first time they happen
+common_error_statuses = [400, 403, 404, 405, 500]
+
+async def get_error_page(status):
+	page = error_pages.pages.get(status)
+	if page is None:
+		body = await load_template('error.html', status=status, message=http.HTTPStatus(status).phrase)
+		page = error_pages.pages[status] = pagecache.CachedPage(f'/{status}', body.encode(), 'text/html', 'utf-8')
+	return page
+
+async def prime_error_pages():
+	for status in common_error_statuses:
+		await get_error_page(status)
+
+def get_error_page_encoded(page, encoding):
+	body = page.encoded.get(encoding)
+	if body is None:
+		body = page.encoded[encoding] = compression.compress(page.body, encoding)
+	return body
+
+async def error_page_response(request, status, message=None, headers=None):
+	'''
+	Returns the error page for the status, from error_pages unless it has an
+	unusual message
+	'''
+	try:
+		phrase = http.HTTPStatus(status).phrase
+	except ValueError:
+		phrase = None
+	if phrase is None or (message is not None and message != phrase):
+		r = web.Response(
+			text=await load_template('error.html', url=request.url, status=status, message=message),
+			content_type='text/html',
+			status=status
+		)
+	else:
+		page = await get_error_page(status)
+		r = web.Response(body=page.body, content_type=page.content_type, charset=page.charset, status=status)
+		r = compress_response(request, r, lambda encoding: get_error_page_encoded(page, encoding))
+	if headers:
+		# things like Allow for 405s
+		for key, value in headers.items():
+			if not key.lower().startswith('content-'):
+				r.headers[key] = value
+	return r
+
+scanner_tracker = scanners.ScannerTracker()
+
+def get_ip(request):
+	return request.headers.get('Cf-Connecting-Ip', request.remote)
+
+def scanner_response(status):
+	# no template, no compression, nothing to see
+	return web.Response(status=status, text=f'{status}', content_type='text/plain')
+
 @web.middleware
 async def error_middleware(request, handler):
+	headers = None
 	try:
 		r = await handler(request)
-		if str(r.status)[0] not in {'4', '5'}:
+		if r.status < 400:
 			return r
-		message, status = r.message, r.status
+		message, status = r.reason, r.status
 	except web.HTTPException as ex:
-		if str(ex.status)[0] not in {'4', '5'}:
+		if ex.status < 400:
 			raise
-		message, status = ex.reason, ex.status
-	r = web.Response(
-		text=await load_template(
-			'error.html', status=status, message=message),
-		content_type='text/html',
-		status=status
-	)
-	r = await custom_replace(r, request)
-	return r
+		message, status, headers = ex.reason, ex.status, ex.headers
+	except renderpool.RenderTimeout as ex:
+		# the post is too long or has something that's too slow to render
+		message, status = str(ex), 400
+	if status == 404 and scanner_tracker.record_miss(get_ip(request), request.path):
+		return scanner_response(status)
+	return await error_page_response(request, status, message, headers)
 
-class cache:
-	htmlcache = {}
-
-async def custom_replace(r, request):
-	newtext = r.text.replace('<< url >>', str(request.url))
-	
-	for url in list(re.finditer('<< loadurl (.+){1,} >>', newtext))[::-1]:
-		raw_url = url.group(1)
-		span = url.span()
-		if raw_url in cache.htmlcache:
-			while cache.htmlcache[raw_url] is None:
-				await asyncio.sleep(0)
-			content = cache.htmlcache[raw_url]
-		else:	
-			print('getting cache for', raw_url)
-			async with aiohttp.ClientSession() as s:
-				cache.htmlcache[raw_url] = None
-				async with s.get(raw_url) as resp:
-					content = await resp.text()
-					if resp.status == 200:
-						cache.htmlcache[raw_url] = content
-					else:
-						print(resp.status)
-					print('gotten', raw_url)
-		newtext = newtext[:span[0]] + content + newtext[span[1]:]
-	r.text = newtext
-	return r
+class static_files:
+	# every path in website/, so requests for files that don't exist can be
+	# answered without going to the disk. files added while the server is
+	# running are 404 until it's restarted.
+	paths = set()
 
+def load_static_files():
+	paths = set()
+	for root, _, filenames in os.walk('website'):
+		for filename in filenames:
+			relative_path = os.path.relpath(os.path.join(root, filename), 'website')
+			paths.add('/' + relative_path.replace(os.sep, '/'))
+	static_files.paths = paths
 
 @web.middleware
-async def middleware(request, handler):
-	path = request.url.path
+async def fast_path_middleware(request, handler):
+	'''
+	Answers the requests that don't need a page before anything else looks
+	at them, so junk requests cost as little as possible
+	'''
+	path = request.path
 	if len(path) > 100:
-		return web.HTTPTemporaryRedirect('/nou')
-	if request.url.path[-1] == '/' and request.url.path != '/':
-		stripped_url = request.url.path.rstrip('/')
-		return web.HTTPPermanentRedirect(stripped_url)
+		raise web.HTTPTemporaryRedirect('/nou')
+	if path[-1] == '/' and path != '/':
+		raise web.HTTPPermanentRedirect(path.rstrip('/'))
+	if isinstance(request.match_info.route.resource, web.StaticResource) and path not in static_files.paths:
+		if scanner_tracker.record_miss(get_ip(request), path):
+			return scanner_response(404)
+		return await error_page_response(request, 404)
+	return await handler(request)
+
+# (method, route): limit, for the routes that can use a lot of the server.
+# they're per worker.
+route_limits = {
+	# waits for recaptcha
+	('POST', '/blog/login'): admission.RouteLimit(concurrency=4, max_waiting=8, rate=5 / 60, burst=5),
+	# render markdown
+	('POST', '/blog/preview'): admission.RouteLimit(concurrency=2, max_waiting=4, rate=1, burst=10),
+	('POST', '/blog/new'): admission.RouteLimit(concurrency=2, max_waiting=4, rate=1, burst=10),
+	('POST', '/blog/edit'): admission.RouteLimit(concurrency=2, max_waiting=4, rate=1, burst=10),
+}
+
+@web.middleware
+async def admission_middleware(request, handler):
+	resource = request.match_info.route.resource
+	limit = None if resource is None else route_limits.get((request.method, resource.canonical))
+	if limit is None:
+		return await handler(request)
+	return await limit.handle(get_ip(request), handler, request)
+
+# the content type of responses with these extensions
+content_types = {
+	'css': 'text/css',
+	'js': 'text/javascript',
+	'html': 'text/html',
+	'json': 'application/json',
+	'xml': 'application/xml',
+	'rss': 'application/rss+xml',
+	'png': 'image/png',
+	'webp': 'image/webp',
+	'avif': 'image/avif',
+}
+
+@web.middleware
+async def middleware(request, handler):
+	path = request.path
 	r = await handler(request)
 	if isinstance(r, str):
 		r = web.Response(
@@ -312,15 +899,6 @@ async def middleware(request, handler):
 				'content-type': 'text/html'
 			}
 		)
-	content_types = {
-		'css': 'text/css',
-		'js': 'text/javascript',
-		'html': 'text/html',
-		'json': 'application/json',
-		'xml': 'application/xml',
-		'rss': 'application/rss+xml',
-		'png': 'image/png'
-	}
 	# if r.content_type == 'application/octet-stream':
 	parts = request.url.parts
 	last_path = parts[-1]
@@ -332,10 +910,9 @@ async def middleware(request, handler):
 			r.content_type = 'text/plain'
 	if path.startswith('/.well-known'):
 		r.headers['Access-Control-Allow-Origin'] = '*'
-	try:
-		r = await custom_replace(r, request)
-	except AttributeError:
-		pass
+	elif path.startswith(images.variants_url) and r.status == 200:
+		# their names change whenever they do
+		r.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
 	return r
 
 async def cloudflare_disable_caching():
@@ -343,27 +920,113 @@ async def cloudflare_disable_caching():
 	api_endpoint = os.getenv('cloudflare_endpoint')
 	api_key = os.getenv('cloudflare_key')
 	api_email = os.getenv('cloudflare_email')
-	async with aiohttp.ClientSession() as s:
-		await s.patch(
-			api_endpoint,
-			headers={
-				'X-Auth-Email': api_email,
-				'X-Auth-Key': api_key
-			},
-			json={'value': 'on'}
-		)
-		print('Disabled CloudFlare caching temporarily')
+	async with httpclient.get_session().patch(
+		api_endpoint,
+		headers={
+			'X-Auth-Email': api_email,
+			'X-Auth-Key': api_key
+		},
+		json={'value': 'on'}
+	):
+		log.info('disabled cloudflare caching temporarily')
 
-async def sitemap_blog_posts():
-	for b in await db.get_blog_posts():
-		sitemap_dict['/blog/post/' + b['slug']] = {
-			'priority': 0.6,
-			'lastmod': datetime.strftime(b['datetime'], '%Y-%m-%dT%H:%I:%SZ')
-		}
+def prime_templates():
+	'''
+	Compiles every template, so the first request for each page doesn't
+	have to
+	'''
+	for filename in jinja_env.list_templates():
+		if filename not in templates.template_dict:
+			templates.template_dict[filename] = jinja_env.get_template(filename)
+
+class startup:
+	import_time = None
+	startup_time = None
+	# whether warm_caches was already done before forking workers
+	warm = False
+
+async def warm_caches():
+	'''
+	Loads everything that's the same for every worker, when there are
+	workers this is only done once before they're forked
+	'''
+	load_projects()
+	await db.create_indexes()
+	await db.load_image_sizes()
+	# before anything is rendered, since images are rendered with their variants
+	made = await asyncio.get_event_loop().run_in_executor(None, images.build_variants)
+	log.info('built image variants', count=made, images=len(images.manifest.images))
+	posts = await db.get_blog_posts(get_hidden=True)
+	# hidden posts are left out of the sitemap, and only searchable by admins
+	load_sitemap(posts)
+	await load_search_index(posts)
+	# so static files can be sent compressed without compressing them every time
+	compressed = await asyncio.get_event_loop().run_in_executor(None, compression.precompress_directory, 'website')
+	log.info('precompressed static files', count=compressed)
+	load_static_files()
+	try:
+		await load_urls()
+	except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+		# they're tried again when a template is first loaded
+		log.warning('failed to get loadurls', error=repr(e))
+	else:
+		prime_templates()
+		await prime_error_pages()
+
+async def warm_before_fork():
+	db.connect()
+	await httpclient.start()
+	try:
+		await warm_caches()
+	finally:
+		# the workers make their own, these can't be shared between processes
+		await httpclient.close()
+		db.close()
+		renderpool.close()
+	startup.warm = True
 
-asyncio.ensure_future(cloudflare_disable_caching())
-asyncio.ensure_future(sitemap_blog_posts())
-app = web.Application(middlewares=[error_middleware, middleware])
-app.add_routes(routes)
-app.add_routes([web.static('/', 'website')])
-web.run_app(app)
\ No newline at end of file
+async def on_startup(app):
+	startup_start = time.perf_counter()
+	db.connect()
+	await httpclient.start()
+	asyncio.ensure_future(cloudflare_disable_caching())
+	if not startup.warm:
+		await warm_caches()
+	else:
+		await reload_posts()
+	await workers.listen(on_worker_message)
+	metrics.start_monitoring()
+	startup.startup_time = time.perf_counter() - startup_start
+	log.info(
+		'started',
+		seconds=round(startup.import_time + startup.startup_time, 2),
+		import_seconds=round(startup.import_time, 2),
+		startup_seconds=round(startup.startup_time, 2)
+	)
+
+async def on_cleanup(app):
+	metrics.stop_monitoring()
+	renderpool.close()
+	workers.close()
+	await httpclient.close()
+	db.close()
+
+def create_app():
+	app = web.Application(middlewares=[metrics_middleware, fast_path_middleware, admission_middleware, compression_middleware, cache_middleware, error_middleware, middleware])
+	app.on_startup.append(on_startup)
+	app.on_cleanup.append(on_cleanup)
+	app.add_routes(routes)
+	app.add_routes([web.static('/', 'website')])
+	return app
+
+startup.import_time = time.perf_counter() - import_start
+
+if __name__ == '__main__':
+	host = os.getenv('host', '0.0.0.0')
+	port = int(os.getenv('port', '8080'))
+	# how many processes to serve from, 0 is one per cpu
+	worker_count = int(os.getenv('workers', '1'))
+	if worker_count == 1:
+		web.run_app(create_app(), host=host, port=port)
+	else:
+		workers.run(create_app, warm_before_fork, host, port, worker_count or None)
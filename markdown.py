@@ -1,5 +1,8 @@
+import bisect
+import html
 import re
-import struct
+import highlight
+import images
 
 '''
 matdoes.dev markdown:
@@ -19,7 +22,8 @@ Normal links: https://matdoes.dev
 Code block: ```lang
 code
 ```
-  If a language is specified, it is highlighted with hljs
+  If a language is specified, it is highlighted with pygments, or with
+  hljs in the browser if pygments doesn't know it
 
 
 Inline code: `code`
@@ -56,24 +60,32 @@ Left image:
 ,![description](https://image)
 Right image:
 .![description](https://image)
+(any other character right before the ! works too, and is removed)
 
 '''
 
-img_pattern = r'!\[(.{1,}?)\]\(([\w\-.\/:?=#]+)\)'
-img_left_pattern = ',' + img_pattern
-img_right_pattern = '.' + img_pattern
+img_pattern = re.compile(r'!\[(.{1,}?)\]\(([\w\-.\/:?=#]+)\)')
 
 
-def get_image_size(data):
-	w, h = struct.unpack('>LL', data[16:24])
-	width = int(w)
-	height = int(h)
-	return width, height
-
 base_url = 'https://matdoes.dev'
 
 def find_images(content):
-	images = re.findall(img_pattern, content)
+	'''
+	Returns the (alt, url) of every image in the markdown
+	'''
+	images = []
+	delimiters = Delimiters(content)
+	start = content.find('![')
+	while start != -1:
+		# only tried if it can end on the same line, so this is linear
+		line_end = delimiters.find('\n', start)
+		if delimiters.find('link_end', start + 3) < line_end:
+			m = img_pattern.match(content, start, line_end)
+			images.append(m.groups())
+			start = m.end()
+		else:
+			start += 1
+		start = content.find('![', start)
 	return images
 
 def find_first_image(content):
@@ -92,7 +104,7 @@ def find_first_image(content):
 
 
 
-def create_responsive_image(src='\\2', alt='\\1', classes=[]):
+def create_lazy_image(src, alt, classes):
 	responsive_class_list = ['lazy'] + classes
 	rclass_str = ' '.join(responsive_class_list)
 	nclass_str = ' '.join(classes)
@@ -101,108 +113,485 @@ def create_responsive_image(src='\\2', alt='\\1', classes=[]):
 	noscript = f'<noscript><img src="{src}" alt="{alt}"{nclass_str}></noscript>'
 	return responsive + noscript
 
-def hl_codeblock(m):
-	hl_type = m.group(1) or 'no-highlight'
-	hl_text = m.group(2)
-	return f'<pre><code class="hljs {hl_type}">{hl_text}</code></pre>'
-
-def parse_markdown(content, nofollow=True):
-	content = content.replace('&', '&amp;')
-	content = content.replace('"', '&quot;')
-	content = content.replace('\r\n', '\n')
-	content = content.replace('<', '&lt;')
-	content = content.replace('>', '&gt;')
-
-	content = content.replace(r'\[', '&#91;')
-	content = content.replace(r'\]', '&#93;')
-	content = content.replace(r'\(', '&#40;')
-	content = content.replace(r'\)', '&#41;')
-	content = content.replace(r'\\', '&#92;')
-	content = content.replace(r'\/', '&#47;')
-	content = content.replace(r'\`', '&#96;')
-	content = content.replace(r'\#', '&#35;')
-	content = content.replace(r'\|', '&#124;')
-	content = content.replace(r'\-', '&#45;')
-	content = content.replace(r'\*', '&#42;')
-	content = content.replace(r'\.', '&#46;')
-	content = content.replace(r'\,', '&#44;')
-
-
-	# inline hyperlinks
-	content = re.sub(r'(?<!\]\()\b(https?:\/\/[\w\-.]{1,}\.[a-z]+)\b', r'<a href="\1">\1</a>', content)
+def create_srcset(urls):
+	return ', '.join(f'{url} {width}w' for width, url in urls)
 
+def create_responsive_image(src='\\2', alt='\\1', classes=[]):
+	'''
+	Like create_lazy_image, but images in website/images have their size, so
+	the page doesn't move when they load, and smaller versions for the
+	browser to choose from. This uses the variants that exist now, so it's
+	only done when pages are shown and never for html that's stored.
+	'''
+	image = images.get_image(src)
+	if image is None:
+		return create_lazy_image(src, alt, classes)
+	responsive_class_list = ['lazy'] + classes
+	rclass_str = ' '.join(responsive_class_list)
+	nclass_str = ' '.join(classes)
+	nclass_str = f' class="{nclass_str}"'
+	size = f' width="{image["width"]}" height="{image["height"]}"'
+	responsive = f'<img data-src="{src}" alt="{alt}" class="{rclass_str}"{size} onload="this.classList.remove(\'lazy\')">'
+	noscript = f'<img src="{src}" alt="{alt}"{nclass_str}{size}>'
+	if image['variants']:
+		responsive_sources = ''
+		noscript_sources = ''
+		for content_type, urls in image['variants'].items():
+			srcset = create_srcset(urls)
+			responsive_sources += f'<source type="{content_type}" data-srcset="{srcset}" sizes="{images.sizes}">'
+			noscript_sources += f'<source type="{content_type}" srcset="{srcset}" sizes="{images.sizes}">'
+		responsive = f'<picture>{responsive_sources}{responsive}</picture>'
+		noscript = f'<picture>{noscript_sources}{noscript}</picture>'
+	return responsive + f'<noscript>{noscript}</noscript>'
+
+# the images made by create_lazy_image in stored html
+lazy_image_pattern = re.compile(
+	r'<img data-src="(?P<src>[^"]*)" alt="(?P<alt>.*?)" class="lazy ?(?P<classes>[^"]*)" '
+	r'onload="this\.classList\.remove\(\'lazy\'\)"><noscript><img src="(?P=src)" alt="(?P=alt)" class="(?P=classes)"></noscript>'
+)
+
+def add_image_variants(post_html):
+	'''
+	Replaces the images in rendered html with create_responsive_image, this
+	is done when a post is shown so the variants are never ones that were
+	removed since it was rendered
+	'''
+	if not images.manifest.images:
+		return post_html
+	def replace(m):
+		if images.get_image(m.group('src')) is None:
+			return m.group(0)
+		return create_responsive_image(m.group('src'), m.group('alt'), m.group('classes').split())
+	return lazy_image_pattern.sub(replace, post_html)
+
+# characters that are replaced by html entities before anything else
+escapes = {
+	'&': '&amp;',
+	'"': '&quot;',
+	'\r\n': '\n',
+	'<': '&lt;',
+	'>': '&gt;',
+	'\t': '&emsp;',
+}
+
+# \[ \] \( \) are always escaped, \\ is escaped next and then the rest
+backslash_escapes = {
+	'[': '&#91;',
+	']': '&#93;',
+	'(': '&#40;',
+	')': '&#41;',
+	'/': '&#47;',
+	'`': '&#96;',
+	'#': '&#35;',
+	'|': '&#124;',
+	'-': '&#45;',
+	'*': '&#42;',
+	'.': '&#46;',
+	',': '&#44;',
+}
+
+escape_pattern = re.compile(r'\r\n|[&"<>\t]|(\\+)([\[\]()/`#|\-*.,]?)')
+
+# code blocks can only contain characters up to \xad, and go until the
+# last ``` that doesn't have any other character before it
+code_word_pattern = re.compile(r'\w+')
+link_pattern = re.compile(r'https?:\/\/[\w\-.]{1,}\.[a-z]+\b')
+code_end_pattern = re.compile(r'[^\0-\xad]')
+
+title_pattern = re.compile(r'(#{1,6}) ')
+inline_start_pattern = re.compile(r'[!\[`*|:]')
+hr_pattern = re.compile(r'-{3,}|_{3,}')
+
+url_chars = r'[\w\-.\/:?=#]+'
+
+# (name, pattern, what it starts with, what ends it) in the order they're
+# tried, rules that end with a delimiter are only tried if it's on the same
+# line, otherwise the .+? would go to the end of the line every time
+inline_rules = [
+	# inline hyperlinks, the lookbehinds come after the h so re can skip
+	# ahead to the h quickly
+	('link', r'h(?<!\]\(h)(?<!\wh)ttps?:\/\/[\w\-.]{1,}\.[a-z]+\b', 'http', None),
 	# left images
-	content = re.sub(
-		img_left_pattern,
-		create_responsive_image(classes=['float-left']),
-		content
-	)
-
-	# right images
-	content = re.sub(
-		img_right_pattern,
-		create_responsive_image(classes=['float-right']),
-		content
-	)
-
+	('left_image', r',!\[(?P<left_alt>.+?)\]\((?P<left_src>' + url_chars + r')\)', ',![', 'link_end'),
+	# right images, any character before the image makes it one (and is
+	# removed) since the . was a regex . before markdown was one pass
+	('right_image', r'(?:&emsp;|.)!\[(?P<right_alt>.+?)\]\((?P<right_src>' + url_chars + r')\)', None, 'link_end'),
 	# images
-	content = re.sub(
-		img_pattern,
-		create_responsive_image(),
-		content
-	)
-
+	('image', r'!\[(?P<alt>.+?)\]\((?P<src>' + url_chars + r')\)', '![', 'link_end'),
 	# external anchors
-	content = re.sub(
-		r'\[(.{1,}?)\]\((https?:\/\/[\w\-.\/:?=#]+)\)',
-		r'<a href="\2" target="_blank" rel="noreferrer">\1</a>',
-		content
-	)
-
+	('external', r'\[(?P<external_text>.+?)\]\((?P<external_url>https?:\/\/' + url_chars + r')\)', '[', 'external_end'),
 	# relative anchors
-	content = re.sub(
-		r'\[(.{1,}?)\]\(([\w\-.\/:?=#]+)\)',
-		r'<a href="\2" target="_blank" aria-label="\1">\1</a>',
-		content
-	)
-
-	# code block
-	content = re.sub(r'```(\w+|)\n?([\0-\255]+)```', hl_codeblock, content)
-
+	('relative', r'\[(?P<relative_text>.+?)\]\((?P<relative_url>' + url_chars + r')\)', '[', 'link_end'),
 	# inline code block
-	content = re.sub(r'`(.{1,}?)`', r'<code>\1</code>', content)
-
-	# block quote
-	content = re.sub(r'^&gt; (.{1,}?)\n', r'<blockquote>\1</blockquote>', content, flags=re.MULTILINE)
-
+	('code', r'`(?P<code_text>.+?)`', '`', '`'),
+	# bold italic, ***text*** was <b><i>text</b></i> when bold was done
+	# before italic, this is that without the tags overlapping
+	('bold_italic', r'\*\*\*(?P<bold_italic_text>[^*\n]+)\*\*\*(?!\*[^\n]+?\*\*)', '***', None),
 	# bold
-	content = re.sub(r'\*\*(.{1,}?)\*\*', r'<b>\1</b>', content)
-
-	# italic
-	content = re.sub(r'\*(.{1,}?)\*', r'<i>\1</i>', content)
-
+	('bold', r'\*\*(?P<bold_text>.+?)\*\*', '**', '**'),
+	# italic, ends at the first * that isn't part of a bold (bold was done
+	# first). it can start with a * if ** didn't start a bold, and can have
+	# bold inside it but can't end inside one, so it doesn't need its end
+	# found first. a ** only starts a bold if there's another ** after it
+	('italic', r'\*(?P<italic_text>[^\n](?:\*\*[^*\n]+\*\*|[^*\n])*)\*(?!\*[^\n]+?\*\*)', '*', None),
 	# center
-	content = re.sub(r'\|\|(.{1,}?)\|\|', r'<span class="center">\1</span>', content)
-
-	# titles
-	content = re.sub(r'^###### (.+)\n', r'\n<h6>\1</h6>', content, flags=re.MULTILINE)
-	content = re.sub(r'^##### (.+)\n', r'\n<h6>\1</h6>', content, flags=re.MULTILINE)
-	content = re.sub(r'^#### (.+)\n', r'\n<h5>\1</h5>', content, flags=re.MULTILINE)
-	content = re.sub(r'^### (.+)\n', r'\n<h4>\1</h4>', content, flags=re.MULTILINE)
-	content = re.sub(r'^## (.+)\n', r'\n<h3>\1</h3>', content, flags=re.MULTILINE)
-	content = re.sub(r'^# (.+)\n', r'\n<h2>\1</h2>', content, flags=re.MULTILINE)
-
-	# horizontal rule
-	content = re.sub(r'\n([-_*])\1{2,}\n', '<hr>\n', content)
+	('center', r'\|\|(?P<center_text>.+?)\|\|', '||', '||'),
+]
+inline_rules = [(name, re.compile(pattern), start, end) for name, pattern, start, end in inline_rules]
+side_image_rules = [rule for rule in inline_rules if rule[0] in ('left_image', 'right_image')]
+# {character: the rules that can match at it}, a right image can start with
+# any character so it's tried first if there's an image after it
+rules_by_char = {
+	char: [rule for rule in inline_rules if rule[2] is not None and rule[2][0] == char]
+	for char in 'h![`*|'
+}
+right_image_rules_by_char = {
+	char: [rule for rule in inline_rules if rule[0] == 'right_image'] + rules
+	for char, rules in rules_by_char.items()
+}
+
+
+class Delimiters:
+	'''
+	Where the delimiters that end inline rules are in a text, they're found
+	once so checking if a rule can end doesn't scan the text again
+	'''
+	patterns = {
+		'link_end': re.compile(r'\]\(' + url_chars + r'\)'),
+		'external_end': re.compile(r'\]\(https?:\/\/' + url_chars + r'\)'),
+	}
+
+	def __init__(self, text):
+		self.text = text
+		# {delimiter: sorted list of where it starts}, found when it's needed
+		self.positions = {}
+
+	def find_all(self, delimiter):
+		pattern = self.patterns.get(delimiter)
+		if pattern is not None:
+			return [m.start() for m in pattern.finditer(self.text)]
+		# the rest are plain strings, str.find is faster than a regex. they
+		# can overlap (*** has ** at two places)
+		positions = []
+		position = self.text.find(delimiter)
+		while position != -1:
+			positions.append(position)
+			position = self.text.find(delimiter, position + 1)
+		return positions
+
+	def find(self, delimiter, start):
+		'''
+		Returns where the first delimiter at or after start is, or the length
+		of the text if there isn't one
+		'''
+		positions = self.positions.get(delimiter)
+		if positions is None:
+			positions = self.positions[delimiter] = self.find_all(delimiter)
+		i = bisect.bisect_left(positions, start)
+		return positions[i] if i < len(positions) else len(self.text)
+
+def escape_markdown(content):
+	def replace(m):
+		backslashes = m.group(1)
+		if backslashes is None:
+			return escapes[m.group(0)]
+		escaped_char = m.group(2)
+		if escaped_char and escaped_char in '[]()':
+			# the last backslash belongs to the bracket, the rest pair up
+			count = len(backslashes) - 1
+			return '&#92;' * (count // 2) + '\\' * (count % 2) + backslash_escapes[escaped_char]
+		count = len(backslashes)
+		escaped = '&#92;' * (count // 2)
+		if count % 2:
+			escaped += backslash_escapes[escaped_char] if escaped_char else '\\'
+		else:
+			escaped += escaped_char
+		return escaped
+	return escape_pattern.sub(replace, content)
+
+def hl_codeblock(lang):
+	hl_type = lang or 'no-highlight'
+	return f'<pre><code class="hljs {hl_type}">', '</code></pre>'
+
+def highlight_code(lang, code):
+	'''
+	Highlights code from escape_markdown, returns None if it can't be
+	'''
+	highlighted = highlight.highlight(lang, html.unescape(code.replace('&emsp;', '\t')))
+	if highlighted is None:
+		return None
+	return highlighted.replace('\t', '&emsp;')
+
+# code blocks that are left for highlight.js, the ones that don't need
+# highlighting or were highlighted already are no-highlight
+client_highlight_pattern = re.compile(r'<code class="hljs (?!no-highlight")')
+
+def needs_highlight_js(post_html):
+	return client_highlight_pattern.search(post_html) is not None
+
+def find_code_block(content, start):
+	'''
+	Finds the first code block at or after start, returns
+	(block start, lang, code start, code end) or None
+	'''
+	block_start = content.find('```', start)
+	while block_start != -1:
+		lang_start = block_start + 3
+		lang_match = code_word_pattern.match(content, lang_start)
+		lang_end = lang_match.end() if lang_match else lang_start
+		if lang_end > lang_start and link_pattern.match(content, lang_start):
+			# links were found before code blocks, so a link can't be a language
+			lang_end = lang_start
+		# (lang end, code start) in the order the regex tried them, the
+		# longest language first with the newline after it in the code or
+		# not. a shorter language only adds the ``` right after it to where
+		# the code can end, since the rest of the language has no `, so one
+		# character shorter is the only one that can be different.
+		attempts = []
+		if content.startswith('\n', lang_end):
+			attempts.append((lang_end, lang_end + 1))
+		attempts.append((lang_end, lang_end))
+		if lang_end > lang_start:
+			attempts.append((lang_end - 1, lang_end - 1))
+		for attempt_lang_end, code_start in attempts:
+			end_match = code_end_pattern.search(content, code_start)
+			code_limit = end_match.start() if end_match else len(content)
+			code_end = content.rfind('```', code_start + 1, code_limit)
+			if code_end != -1:
+				return block_start, content[lang_start:attempt_lang_end], code_start, code_end
+		block_start = content.find('```', block_start + 1)
+	return None
+
+def split_code_blocks(content, highlight_blocks=True):
+	'''
+	Splits escaped markdown into (is_html, text) segments, where the html
+	segments are the tags that start and end code blocks and the code that
+	was highlighted
+	'''
+	segments = []
+	pos = 0
+	highlight_left = highlight.max_post_length
+	while True:
+		block = find_code_block(content, pos)
+		if block is None:
+			break
+		block_start, lang, code_start, code_end = block
+		code = content[code_start:code_end]
+		highlighted = None
+		if highlight_blocks and len(code) <= highlight_left:
+			highlighted = highlight_code(lang, code)
+			if highlighted is not None:
+				highlight_left -= len(code)
+		segments.append((False, content[pos:block_start]))
+		if highlighted is None:
+			start_tag, end_tag = hl_codeblock(lang)
+			segments.append((True, start_tag))
+			segments.append((False, code))
+			segments.append((True, end_tag))
+		else:
+			start_tag, end_tag = hl_codeblock(None)
+			segments.append((True, start_tag))
+			segments.append((True, highlighted))
+			segments.append((True, end_tag))
+		pos = code_end + 3
+	segments.append((False, content[pos:]))
+	return segments
+
+def render_link(m, plain):
+	url = m.group()
+	if plain:
+		return url
+	return f'<a href="{url}">{url}</a>'
+
+def render_image(src, alt, classes, plain):
+	if plain:
+		return ''
+	return create_lazy_image(src, render_inline(alt), classes)
+
+def render_left_image(m, plain):
+	return render_image(m.group('left_src'), m.group('left_alt'), ['float-left'], plain)
+
+def render_right_image(m, plain):
+	return render_image(m.group('right_src'), m.group('right_alt'), ['float-right'], plain)
+
+def render_plain_image(m, plain):
+	return render_image(m.group('src'), m.group('alt'), [], plain)
+
+def render_external(m, plain):
+	text = render_inline(m.group('external_text'), plain)
+	if plain:
+		return text
+	url = m.group('external_url')
+	return f'<a href="{url}" target="_blank" rel="noreferrer">{text}</a>'
+
+def render_relative(m, plain):
+	text = render_inline(m.group('relative_text'), plain)
+	if plain:
+		return text
+	url = m.group('relative_url')
+	return f'<a href="{url}" target="_blank" aria-label="{text}">{text}</a>'
+
+def render_tag(group, tag, attributes=''):
+	def render(m, plain):
+		text = render_inline(m.group(group), plain)
+		if plain:
+			return text
+		return f'<{tag}{attributes}>{text}</{tag}>'
+	return render
+
+def render_bold_italic(m, plain):
+	text = render_inline(m.group('bold_italic_text'), plain)
+	if plain:
+		return text
+	return f'<b><i>{text}</i></b>'
+
+inline_renderers = {
+	'link': render_link,
+	'left_image': render_left_image,
+	'right_image': render_right_image,
+	'image': render_plain_image,
+	'external': render_external,
+	'relative': render_relative,
+	'code': render_tag('code_text', 'code'),
+	'bold_italic': render_bold_italic,
+	'bold': render_tag('bold_text', 'b'),
+	'italic': render_tag('italic_text', 'i'),
+	'center': render_tag('center_text', 'span', ' class="center"'),
+}
+
+def match_inline(text, start, line_end, delimiters, rules):
+	'''
+	Returns (rule name, match) of the first of the rules that matches at
+	start, or None
+	'''
+	for name, pattern, rule_start, rule_end in rules:
+		if rule_start is not None:
+			if not text.startswith(rule_start, start):
+				continue
+			content_start = start + len(rule_start)
+		elif text.startswith('&emsp;![', start):
+			content_start = start + 8
+		elif text.startswith('![', start + 1) and text[start] != '\n':
+			content_start = start + 3
+		else:
+			continue
+		# the text between the start and end can't be empty
+		if rule_end is not None and delimiters.find(rule_end, content_start + 1) >= line_end:
+			continue
+		m = pattern.match(text, start, line_end)
+		if m is not None:
+			return name, m
+	return None
+
+def render_inline(text, plain=False):
+	'''
+	Renders the inline markdown (links, images, code, bold, italic and
+	center) in text, none of these can go over multiple lines
+	'''
+	output = []
+	pos = 0
+	delimiters = Delimiters(text)
+	line_end = -1
+	for candidate in inline_start_pattern.finditer(text):
+		start = candidate.start()
+		if start < pos:
+			continue
+		if start > line_end:
+			line_end = text.find('\n', start)
+			if line_end == -1:
+				line_end = len(text)
+		char = text[start]
+		if char == ':':
+			# hyperlinks are found from the : after http or https
+			if text.startswith('https', start - 5):
+				start -= 5
+			elif text.startswith('http', start - 4):
+				start -= 4
+			else:
+				continue
+			if start < pos:
+				continue
+			char = 'h'
+		m = None
+		if char == '!' and start > pos and text[start - 1] != '\n':
+			# left and right images start with the character before the !,
+			# tabs were one character when images were matched
+			before = 6 if start - 6 >= pos and text.startswith('&emsp;', start - 6) else 1
+			m = match_inline(text, start - before, line_end, delimiters, side_image_rules)
+		if m is None:
+			rules = right_image_rules_by_char if text.startswith('![', start + 1) else rules_by_char
+			m = match_inline(text, start, line_end, delimiters, rules[char])
+		if m is None:
+			continue
+		name, m = m
+		output.append(text[pos:m.start()])
+		output.append(inline_renderers[name](m, plain))
+		pos = m.end()
+	output.append(text[pos:])
+	return ''.join(output)
+
+def compile_markdown(content, plain=False, highlight_blocks=True):
+	'''
+	Compiles matdoes.dev markdown to html, or to plain text with no tags if
+	plain is True. Every rule is applied in the same pass over the content.
+	Code blocks are only highlighted if highlight_blocks is True.
+	'''
+	newline = '\n' if plain else '<br>'
+	segments = split_code_blocks(escape_markdown(content), highlight_blocks=highlight_blocks and not plain)
+	# highlighted code is only its newlines here, so its lines can't become
+	# titles or blockquotes
+	source_lines = ''.join(
+		'\n' * text.count('\n') if is_html and '\n' in text else text
+		for is_html, text in segments
+	).split('\n')
+	lines = ''.join(
+		('' if plain else text) if is_html else render_inline(text, plain)
+		for is_html, text in segments
+	).split('\n')
+	last_line = len(lines) - 1
+
+	# blockquotes and titles eat the newline after them, so the line after
+	# isn't at the start of a line anymore for the rules that come after
+	kinds = []
+	for i, source_line in enumerate(source_lines):
+		prev_kind = kinds[i - 1] if i > 0 else None
+		kind = None
+		if i < last_line:
+			title_match = title_pattern.match(source_line)
+			if source_line.startswith('&gt; ') and len(source_line) > 5:
+				kind = ('blockquote', 5)
+			elif title_match and len(source_line) > title_match.end():
+				# titles are replaced one level at a time, starting at ######
+				level = len(title_match.group(1))
+				if prev_kind is None or prev_kind[0] == 'hr' or prev_kind[0] == 'title' and prev_kind[1] <= level + 1:
+					kind = ('title', level + 1)
+			elif i > 0 and prev_kind is None and hr_pattern.fullmatch(source_line):
+				kind = ('hr',)
+		kinds.append(kind)
+	kinds.append(None)
+
+	output = []
+	for i, line in enumerate(lines):
+		kind = kinds[i]
+		if kind is None:
+			output.append(line)
+			if i < last_line and kinds[i + 1] != ('hr',):
+				output.append(newline)
+		elif kind[0] == 'blockquote':
+			text = line[kind[1]:]
+			output.append(text if plain else f'<blockquote>{text}</blockquote>')
+		elif kind[0] == 'title':
+			text = line[kind[1]:]
+			tag = f'h{min(kind[1], 6)}'
+			output.append(newline)
+			output.append(text if plain else f'<{tag}>{text}</{tag}>')
+		else:
+			output.append(' ' if plain else '<hr>')
+			output.append(newline)
+	return ''.join(output)
 
-
-	content = content.replace('\n', '<br>')
-	content = content.replace('\t', '&emsp;')
-	return content
+def parse_markdown(content, nofollow=True):
+	return compile_markdown(content)
 
 def remove_markdown(content):
-	content = parse_markdown(content)
-	content = content.replace('<br>', '\n')
-	content = content.replace('<hr>', ' ')
-	content = re.sub(r'<.{1,}?>', '', content)
-	return content
+	return compile_markdown(content, plain=True)
@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import sys
+import time
+import markdown
+
+'''
+Checks markdown against a corpus of posts and the html and text they were
+rendered as, so changes to the renderer don't change old posts by accident.
+The cases are hand written ones, random mixes of every kind of markdown,
+and posts like the ones benchmark.py makes.
+
+Cases with old_html are rendered differently than they were by the
+renderer before it was one pass (the chain of regexes), old_html is what
+that made. They're all ones where the old renderer broke the markdown:
+
+- an image right after something that ends with a character (the ` of
+  code, the * of italic, the ) of a link, the > of another image's html
+  or the last letter of a code block's language) took that character as
+  if it was a right image, so what it ended wasn't rendered
+- links and inline code were done before code blocks, so they could
+  start before a code block and end inside or after it
+- blockquotes joined their line to the next one before bold and italic
+  were done, so those could go over two lines
+- tags that overlapped or were inside another tag's attribute. most of
+  these are stars, like *i***b** which was <i>i<b></i>b</b>: bold was
+  done before italic so an italic could end inside a bold. now an italic
+  can't, and its * is left as it is
+
+It also checks that rendering takes linear time, with inputs that make a
+rule scan the rest of the line every time it's tried if it's done wrong.
+
+python markdown_golden.py             check the corpus and the scaling
+python markdown_golden.py --update    save what's rendered now as the corpus
+'''
+
+default_path = 'markdown_golden.json'
+
+# {name: function that makes an input about n characters long}
+scaling_inputs = {
+	'brackets': lambda n: '[' * n,
+	'images': lambda n: '![' * (n // 2),
+	'side images': lambda n: 'x![' * (n // 3),
+	'tab images': lambda n: '\t![' * (n // 3),
+	'links': lambda n: '[a](/x)' * (n // 7),
+	'unclosed links': lambda n: '[a](' * (n // 4),
+	'backticks': lambda n: '`' * n,
+	'stars': lambda n: '*' * n,
+	'italic and bold': lambda n: '*' + 'a**b**' * (n // 6),
+	'italic ends': lambda n: '*a**' * (n // 4),
+	'bold italics': lambda n: '***a' * (n // 4),
+	'stars at the end': lambda n: '*' + 'a' * n + '***',
+	'bars': lambda n: '|' * n,
+	'code language': lambda n: '```' + 'a' * n,
+	'fences': lambda n: '```' * (n // 3),
+	'fence lines': lambda n: '```\n' * (n // 4),
+}
+# rendering something 4 times as long can take this many times longer, it
+# would be 16 if it was quadratic
+max_scaling = 8
+scaling_size = 4000
+
+
+def time_render(content):
+	# the fastest of a few, so the check doesn't fail because of one slow run
+	times = []
+	for _ in range(3):
+		start = time.perf_counter()
+		markdown.compile_markdown(content, highlight_blocks=False)
+		markdown.find_images(content)
+		times.append(time.perf_counter() - start)
+	return min(times)
+
+def check_scaling():
+	'''
+	Prints the inputs that take much more than 4 times longer to render when
+	they're 4 times longer, returns how many there are
+	'''
+	failed = 0
+	for name, make_input in scaling_inputs.items():
+		small = time_render(make_input(scaling_size))
+		large = time_render(make_input(scaling_size * 4))
+		if large > small * max_scaling:
+			failed += 1
+			print(f'{name}: {small * 1000:.1f}ms for {scaling_size} characters, {large * 1000:.1f}ms for {scaling_size * 4}')
+	return failed
+
+
+def render(content):
+	# highlighting depends on pygments being installed, it's checked in
+	# highlight.py instead
+	return {
+		'html': markdown.compile_markdown(content, highlight_blocks=False),
+		'text': markdown.compile_markdown(content, plain=True),
+	}
+
+def check(cases):
+	'''
+	Prints the cases that render differently than in the corpus, returns
+	how many there are
+	'''
+	failed = 0
+	for case in cases:
+		rendered = render(case['content'])
+		for key in ('html', 'text'):
+			if rendered[key] != case[key]:
+				failed += 1
+				print(f'{case["name"]}: {key} changed')
+				print('  content ', repr(case['content']))
+				print('  expected', repr(case[key]))
+				print('  got     ', repr(rendered[key]))
+				break
+	return failed
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--path', default=default_path, help='corpus json')
+	parser.add_argument('--update', action='store_true', help='save what\'s rendered now as the corpus')
+	args = parser.parse_args()
+
+	os.chdir(os.path.dirname(os.path.abspath(__file__)))
+	with open(args.path) as f:
+		cases = json.load(f)
+
+	if args.update:
+		for case in cases:
+			case.update(render(case['content']))
+		with open(args.path, 'w') as f:
+			json.dump(cases, f, indent='\t', ensure_ascii=False)
+			f.write('\n')
+		print('Saved', len(cases), 'cases')
+		return
+
+	failed = check(cases)
+	print(f'{len(cases) - failed}/{len(cases)} cases rendered the same')
+	slow = check_scaling()
+	print(f'{len(scaling_inputs) - slow}/{len(scaling_inputs)} inputs rendered in linear time')
+	if failed or slow:
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,201 @@
+import asyncio
+import bisect
+import contextvars
+import time
+
+'''
+Request timing and prometheus metrics. Slow parts of a request are wrapped
+in timed('name') and show up in the Server-Timing header of the response,
+and every request and timed part is also counted in a histogram that's
+shown by render() in the prometheus text format.
+
+Metrics are per process, so with workers each one has its own.
+They're at /metrics for admins, and for localhost if trust_localhost=true
+is set (only do that if the proxy in front sets X-Forwarded-For).
+'''
+
+# in seconds, the same as the default prometheus client buckets
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# the timings of the request that's being handled, {name: [seconds, calls]}
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Histogram:
+	def __init__(self, name, help_text, label, buckets=default_buckets):
+		self.name = name
+		self.help_text = help_text
+		self.label = label
+		self.buckets = buckets
+		# {label value: [bucket counts, sum, count]}
+		self.values = {}
+
+	def observe(self, label_value, value):
+		data = self.values.get(label_value)
+		if data is None:
+			data = self.values[label_value] = [[0] * len(self.buckets), 0, 0]
+		index = bisect.bisect_left(self.buckets, value)
+		if index < len(self.buckets):
+			data[0][index] += 1
+		data[1] += value
+		data[2] += 1
+
+	def render(self):
+		lines = [
+			f'# HELP {self.name} {self.help_text}',
+			f'# TYPE {self.name} histogram',
+		]
+		for label_value, (bucket_counts, total, count) in sorted(self.values.items()):
+			# histograms without a label are always observed with None
+			label = f'{self.label}="{escape_label(label_value)}"' if self.label else ''
+			bucket_label = label + ',' if label else ''
+			cumulative = 0
+			for bucket, bucket_count in zip(self.buckets, bucket_counts):
+				cumulative += bucket_count
+				lines.append(f'{self.name}_bucket{{{bucket_label}le="{bucket}"}} {cumulative}')
+			lines.append(f'{self.name}_bucket{{{bucket_label}le="+Inf"}} {count}')
+			suffix = f'{{{label}}}' if label else ''
+			lines.append(f'{self.name}_sum{suffix} {total}')
+			lines.append(f'{self.name}_count{suffix} {count}')
+		return lines
+
+
+class Counter:
+	def __init__(self, name, help_text, labels):
+		self.name = name
+		self.help_text = help_text
+		self.labels = labels
+		self.values = {}
+
+	def inc(self, *label_values, amount=1):
+		self.values[label_values] = self.values.get(label_values, 0) + amount
+
+	def render(self):
+		lines = [
+			f'# HELP {self.name} {self.help_text}',
+			f'# TYPE {self.name} counter',
+		]
+		for label_values, value in sorted(self.values.items()):
+			labels = ','.join(f'{k}="{escape_label(v)}"' for k, v in zip(self.labels, label_values))
+			lines.append(f'{self.name}{{{labels}}} {value}')
+		return lines
+
+
+request_duration = Histogram(
+	'http_request_duration_seconds', 'How long requests took to handle', 'route'
+)
+requests_total = Counter(
+	'http_requests_total', 'Requests handled', ['route', 'status']
+)
+phase_duration = Histogram(
+	'phase_duration_seconds', 'How long the timed parts of requests took', 'phase'
+)
+event_loop_lag = Histogram(
+	'event_loop_lag_seconds', 'How much later than it should have the event loop ran a timer', None,
+	buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+# functions that return {name: (help text, type, value or {labels: value})}
+# of anything else that should be shown, they're called for every scrape
+collectors = []
+
+
+def escape_label(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class timed:
+	'''
+	Adds how long the with block took to the current request's timings
+	'''
+	__slots__ = ('name', 'start')
+
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc_info):
+		duration = time.perf_counter() - self.start
+		phase_duration.observe(self.name, duration)
+		timings = request_timings.get()
+		if timings is not None:
+			timing = timings.get(self.name)
+			if timing is None:
+				timings[self.name] = [duration, 1]
+			else:
+				timing[0] += duration
+				timing[1] += 1
+
+
+class event_loop:
+	# how late the last check was, in seconds
+	lag = 0
+	task = None
+
+async def monitor_event_loop(interval=0.25):
+	'''
+	Sleeps for interval over and over, if it takes longer than that then
+	something blocked the event loop for the difference
+	'''
+	loop = asyncio.get_event_loop()
+	while True:
+		start = loop.time()
+		await asyncio.sleep(interval)
+		event_loop.lag = max(loop.time() - start - interval, 0)
+		event_loop_lag.observe(None, event_loop.lag)
+
+def start_monitoring():
+	if event_loop.task is None:
+		event_loop.task = asyncio.ensure_future(monitor_event_loop())
+
+def stop_monitoring():
+	if event_loop.task is not None:
+		event_loop.task.cancel()
+		event_loop.task = None
+
+def start_request():
+	'''
+	Starts recording the timings for this request, returns them
+	'''
+	timings = {}
+	request_timings.set(timings)
+	return timings
+
+def finish_request(route, status, duration, timings):
+	'''
+	Records the request in the metrics, returns the Server-Timing header
+	'''
+	request_duration.observe(route, duration)
+	requests_total.inc(route, status)
+	parts = [
+		f'{name};dur={seconds * 1000:.2f};desc="{calls} call{"" if calls == 1 else "s"}"'
+		for name, (seconds, calls) in timings.items()
+	]
+	parts.append(f'total;dur={duration * 1000:.2f}')
+	return ', '.join(parts)
+
+def render_collected(name, help_text, metric_type, value):
+	lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+	if isinstance(value, dict):
+		for labels, label_value in value.items():
+			label_str = ','.join(f'{k}="{escape_label(v)}"' for k, v in labels)
+			lines.append(f'{name}{{{label_str}}} {label_value}')
+	else:
+		lines.append(f'{name} {value}')
+	return lines
+
+def render():
+	lines = []
+	for metric in (request_duration, requests_total, phase_duration, event_loop_lag):
+		lines.extend(metric.render())
+	lines.extend(render_collected(
+		'event_loop_lag_last_seconds', 'How late the event loop was the last time it was checked',
+		'gauge', event_loop.lag
+	))
+	for collector in collectors:
+		for name, (help_text, metric_type, value) in collector().items():
+			lines.extend(render_collected(name, help_text, metric_type, value))
+	return '\n'.join(lines) + '\n'
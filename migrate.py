@@ -0,0 +1,20 @@
+import asyncio
+import sys
+import database as db
+
+'''
+Renders and stores the html, text, description and read time of posts
+that don't have them yet, or were rendered by an older renderer_version.
+
+python3 migrate.py [--force]
+'''
+
+async def main():
+	force = '--force' in sys.argv
+	db.connect()
+	updated = await db.backfill_rendered_posts(force=force)
+	print(f'Rendered {updated} posts')
+	db.close()
+
+if __name__ == '__main__':
+	asyncio.get_event_loop().run_until_complete(main())
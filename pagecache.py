@@ -0,0 +1,108 @@
+from collections import OrderedDict
+import compression
+
+
+class CachedPage:
+	def __init__(self, path, body, content_type, charset, etag=None, last_modified=None):
+		self.path = path
+		self.body = body
+		self.content_type = content_type
+		self.charset = charset
+		self.etag = etag
+		self.last_modified = last_modified
+		# compressed versions of the body, by encoding
+		self.encoded = {}
+
+	@property
+	def size(self):
+		return len(self.body) + sum(len(body) for body in self.encoded.values())
+
+
+class PageCache:
+	'''
+	LRU cache of rendered pages, limited by the total size of their bodies.
+	Pages are also indexed by path so every page for a path (e.g. all the
+	pages of /blog) can be invalidated at once.
+	'''
+	def __init__(self, max_bytes=32 * 1024 * 1024, max_entries=4096):
+		self.max_bytes = max_bytes
+		self.max_entries = max_entries
+		self.pages = OrderedDict()
+		self.paths = {}
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+
+	def get(self, key):
+		page = self.pages.get(key)
+		if page is None:
+			self.misses += 1
+			return None
+		self.pages.move_to_end(key)
+		self.hits += 1
+		return page
+
+	def set(self, key, page):
+		if len(page.body) > self.max_bytes:
+			return
+		self.remove(key)
+		self.pages[key] = page
+		self.paths.setdefault(page.path, set()).add(key)
+		self.size += page.size
+		self.evict()
+
+	def evict(self):
+		while self.size > self.max_bytes or len(self.pages) > self.max_entries:
+			oldest_key = next(iter(self.pages))
+			self.remove(oldest_key)
+			self.evictions += 1
+
+	def get_encoded(self, key, page, encoding):
+		'''
+		Returns the body of the page compressed with encoding, it's only
+		compressed the first time and then kept with the page
+		'''
+		body = page.encoded.get(encoding)
+		if body is None:
+			body = compression.compress(page.body, encoding)
+			page.encoded[encoding] = body
+			if self.pages.get(key) is page:
+				self.size += len(body)
+				self.evict()
+		return body
+
+	def remove(self, key):
+		page = self.pages.pop(key, None)
+		if page is None:
+			return
+		self.size -= page.size
+		keys = self.paths[page.path]
+		keys.discard(key)
+		if not keys:
+			del self.paths[page.path]
+
+	def invalidate(self, *paths):
+		for path in paths:
+			for key in list(self.paths.get(path, ())):
+				self.remove(key)
+				self.invalidations += 1
+
+	def clear(self):
+		self.pages.clear()
+		self.paths.clear()
+		self.size = 0
+
+	def stats(self):
+		requests = self.hits + self.misses
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'hit_ratio': self.hits / requests if requests else 0,
+			'evictions': self.evictions,
+			'invalidations': self.invalidations,
+			'pages': len(self.pages),
+			'bytes': self.size,
+			'max_bytes': self.max_bytes,
+		}
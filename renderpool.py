@@ -0,0 +1,96 @@
+import asyncio
+import concurrent.futures
+import os
+import metrics
+
+'''
+Runs expensive functions (rendering long posts) in other processes, so a
+big or pathological post can't block every other request. Small inputs are
+still done inline since sending them to another process costs more than
+rendering them.
+'''
+
+# inputs shorter than this are done on the event loop. markdown takes time
+# linear in its length (markdown_golden.py checks it), the worst markdown
+# this long takes about 0.15s, which is why the timeout can skip them
+inline_limit = int(os.getenv('render_inline_limit', '20000'))
+# a render that takes longer than this is killed
+timeout = float(os.getenv('render_timeout', '10'))
+max_processes = int(os.getenv('render_processes', '2'))
+
+
+class RenderTimeout(Exception):
+	pass
+
+
+class pool:
+	# made on first use, so with workers every worker has its own
+	executor = None
+
+
+def forget_executor():
+	# a forked process has a copy of the executor but not its processes or
+	# the thread that talks to them, so it has to make its own
+	pool.executor = None
+
+def get_executor():
+	if pool.executor is None:
+		pool.executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_processes)
+	return pool.executor
+
+def kill_executor():
+	'''
+	Stops every process in the pool, this is the only way to stop a render
+	that's already running. Anything else in the pool fails with
+	BrokenProcessPool and is retried in a new pool.
+	'''
+	executor = pool.executor
+	if executor is None:
+		return
+	pool.executor = None
+	# there's no public way to get the processes. the renders waiting in
+	# the pool fail with BrokenProcessPool once they're gone, cancelling
+	# them instead would look like their requests went away
+	for process in list((executor._processes or {}).values()):
+		process.terminate()
+	executor.shutdown(wait=False)
+
+def close():
+	if pool.executor is not None:
+		pool.executor.shutdown(wait=False)
+		pool.executor = None
+
+async def run(function, size, *args):
+	'''
+	Calls function with args, in the process pool if size is at least
+	inline_limit. Raises RenderTimeout if it takes longer than timeout.
+	'''
+	if size < inline_limit:
+		return function(*args)
+	for attempt in range(2):
+		executor = get_executor()
+		future = None
+		try:
+			# submit raises BrokenProcessPool too if the pool was killed
+			# but this process hasn't noticed yet
+			future = executor.submit(function, *args)
+			with metrics.timed('render_pool'):
+				return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+		except asyncio.TimeoutError:
+			kill_executor()
+			raise RenderTimeout(f'Rendering took longer than {timeout}s')
+		except asyncio.CancelledError:
+			# the request went away, if its render already started it has
+			# to be killed so it doesn't keep using a cpu
+			if future is not None and not future.cancel() and not future.done():
+				kill_executor()
+			raise
+		except concurrent.futures.process.BrokenProcessPool:
+			# another render killed the pool while this one was in it
+			if attempt == 1:
+				raise
+			if pool.executor is executor:
+				pool.executor = None
+
+
+os.register_at_fork(after_in_child=forget_executor)
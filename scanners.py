@@ -0,0 +1,61 @@
+import re
+import time
+from sessioncache import LRU
+
+'''
+Finds ips that request lots of pages that don't exist, which is almost
+always a bot looking for admin pages and leaked files. They're sent a tiny
+404 instead of the error page, so they cost as little as possible.
+'''
+
+# paths that are only ever requested by bots looking for something to exploit
+probe_pattern = re.compile(
+	r'\.(php|asp|aspx|jsp|cgi|env|sql|bak|ini)$|/wp-|/\.(env|git|aws|ssh|svn)\b',
+	re.IGNORECASE
+)
+
+
+class ScannerTracker:
+	'''
+	Counts the 404s every ip got in the last window seconds, an ip that gets
+	threshold of them (or requests a probe path) is a scanner for the next
+	block_time seconds. Only the ips that were seen most recently are
+	remembered, so it can't use much memory.
+	'''
+	def __init__(self, max_ips=10000, threshold=20, window=60, block_time=3600):
+		self.threshold = threshold
+		self.window = window
+		self.block_time = block_time
+		# {ip: [404s]}, each entry expires window seconds after its first 404
+		self.counts = LRU(max_ips)
+		self.scanners = LRU(max_ips)
+		self.flagged = 0
+
+	def is_scanner(self, ip):
+		return self.scanners.get(ip) is not None
+
+	def record_miss(self, ip, path):
+		'''
+		Counts a 404 for the ip, returns whether it's a scanner
+		'''
+		if self.is_scanner(ip):
+			return True
+		now = time.time()
+		count = self.counts.get(ip)
+		if count is None:
+			count = [0]
+			self.counts.set(ip, count, now + self.window)
+		count[0] += 1
+		if count[0] >= self.threshold or probe_pattern.search(path):
+			self.counts.remove(ip)
+			self.scanners.set(ip, True, now + self.block_time)
+			self.flagged += 1
+			return True
+		return False
+
+	def stats(self):
+		return {
+			'tracked': len(self.counts.items),
+			'scanners': len(self.scanners.items),
+			'flagged': self.flagged,
+		}
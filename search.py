@@ -0,0 +1,334 @@
+import functools
+import heapq
+import html
+import json
+import math
+import os
+import re
+from datetime import datetime
+
+'''
+Full text search over the blog posts. Every post's title and text are split
+into stemmed words and kept in an inverted index ({word: {post id: count}}),
+so a search only has to look at the posts that have the words it's for.
+Results are ranked with BM25.
+
+The index is saved to a snapshot file so it doesn't have to be made from
+every post again when the server starts, only the posts that changed since
+the snapshot are added again.
+'''
+
+# change this when tokenize, stem or the stored documents change, so old
+# snapshots aren't used
+version = 2
+
+# bm25 parameters, these are the usual values
+k1 = 1.2
+b = 0.75
+# words in the title count as this many words in the text
+title_weight = 3
+
+# longer queries are cut off, so a search can't make the server do much
+max_query_length = 200
+# how many characters of the text are shown around the matches, and how
+# many of them are before the first match
+snippet_length = 200
+snippet_context = 40
+# stop looking for a better snippet after this many matches, or this many
+# characters into the text
+max_snippet_hits = 50
+max_snippet_scan = 20000
+
+word_pattern = re.compile(r'\w+')
+
+stop_words = {
+	'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if', 'in',
+	'into', 'is', 'it', 'no', 'not', 'of', 'on', 'or', 'so', 'such', 'that',
+	'the', 'their', 'then', 'there', 'these', 'they', 'this', 'to', 'was',
+	'will', 'with', 'i', 'you', 'my', 'me', 'we', 'do', 'does'
+}
+
+# (suffix, replacement), the first one that matches is used
+suffixes = (
+	('sses', 'ss'),
+	('ies', 'y'),
+	('ied', 'y'),
+	('ing', ''),
+	('edly', ''),
+	('ed', ''),
+	('ly', ''),
+	('ss', 'ss'),
+	('s', ''),
+)
+
+
+# the same words are stemmed over and over when making snippets
+@functools.lru_cache(maxsize=65536)
+def stem(word):
+	'''
+	Removes common english suffixes so different forms of a word are found
+	by the same search, it's much simpler than a real stemmer but it gets
+	plurals and most verbs right
+	'''
+	if len(word) <= 3 or word.isdigit():
+		return word
+	for suffix, replacement in suffixes:
+		if word.endswith(suffix):
+			stemmed = word[:-len(suffix)] + replacement
+			# so "ring" isn't "r" and "bed" isn't "b"
+			if len(stemmed) < 3:
+				return word
+			# "running" -> "runn" -> "run"
+			if suffix in ('ing', 'ed') and len(stemmed) > 3 and stemmed[-1] == stemmed[-2] and stemmed[-1] not in 'lsz':
+				stemmed = stemmed[:-1]
+			return stemmed
+	return word
+
+def tokenize(text):
+	'''
+	Returns the stemmed words in the text that aren't stop words
+	'''
+	words = []
+	for word in word_pattern.findall(text.lower()):
+		word = word.strip('_')
+		if not word or word in stop_words:
+			continue
+		words.append(stem(word))
+	return words
+
+def count_words(words, counts=None, weight=1):
+	if counts is None:
+		counts = {}
+	for word in words:
+		counts[word] = counts.get(word, 0) + weight
+	return counts
+
+
+def make_snippet(text, query_words):
+	'''
+	Returns the html of the part of the text with the most words from the
+	search, with the words in <mark>
+	'''
+	# finding words that start like the query words with a regex and only
+	# stemming those is much faster than stemming every word in a long post
+	prefixes = sorted({word[:-1] if len(word) > 3 else word for word in query_words}, key=len, reverse=True)
+	# no \b and no re.IGNORECASE, either of them makes the regex check
+	# every character instead of looking for the prefixes
+	pattern = re.compile('(?:' + '|'.join(map(re.escape, prefixes)) + r')\w*')
+	lowered = text[:max_snippet_scan].lower()
+	if len(lowered) != len(text[:max_snippet_scan]):
+		# a few characters change length when they're lowercased
+		lowered = text[:max_snippet_scan]
+		pattern = re.compile(pattern.pattern, re.IGNORECASE)
+	hits = []
+	for m in pattern.finditer(lowered):
+		start = m.start()
+		# only the start of words
+		if start > 0 and (lowered[start - 1].isalnum() or lowered[start - 1] == '_'):
+			continue
+		if stem(m.group().lower().strip('_')) in query_words:
+			hits.append(m.span())
+			# a long post can have thousands, the best snippet is usually
+			# near the start anyway
+			if len(hits) >= max_snippet_hits:
+				break
+
+	# the snippet_length characters starting at a hit with the most hits
+	best_start = 0
+	best_hits = 0
+	end_index = 0
+	for start_index, (start, _) in enumerate(hits):
+		while end_index < len(hits) and hits[end_index][1] <= start + snippet_length:
+			end_index += 1
+		if end_index - start_index > best_hits:
+			best_start, best_hits = start, end_index - start_index
+
+	# start a little before the first hit, at the start of a word
+	start = max(best_start - snippet_context, 0)
+	if start > 0:
+		start = text.find(' ', start, best_start) + 1 or best_start
+	end = start + snippet_length
+	if end < len(text):
+		# and end at the end of one
+		space = text.rfind(' ', best_start, end)
+		if space > best_start:
+			end = space
+
+	parts = []
+	position = start
+	for hit_start, hit_end in hits:
+		if hit_start < start:
+			continue
+		if hit_end > end:
+			break
+		parts.append(html.escape(text[position:hit_start]))
+		parts.append(f'<mark>{html.escape(text[hit_start:hit_end])}</mark>')
+		position = hit_end
+	parts.append(html.escape(text[position:end]))
+	snippet = ''.join(parts).strip()
+	if start > 0:
+		snippet = '…' + snippet
+	if end < len(text):
+		snippet += '…'
+	return snippet
+
+
+class SearchIndex:
+	def __init__(self):
+		# {post id: {'slug', 'title', 'text', 'hidden', 'datetime', 'edited_time', 'length', 'words'}}
+		self.documents = {}
+		# {word: {post id: how many times it's in the post}}
+		self.postings = {}
+		# {post id: how many words it has}, separate so scoring is faster
+		self.lengths = {}
+		self.total_length = 0
+
+	def __len__(self):
+		return len(self.documents)
+
+	def add(self, post):
+		'''
+		Adds a post (from convert_post) to the index, replacing it if it's
+		already there
+		'''
+		# the text is from remove_markdown, so it has html entities
+		text = html.unescape(post['text'])
+		words = count_words(tokenize(post['title']), weight=title_weight)
+		count_words(tokenize(text), words)
+		self.add_document(post['id'], {
+			'slug': post['slug'],
+			'title': post['title'],
+			'text': text,
+			'hidden': post['hidden'],
+			'datetime': post['datetime'],
+			'edited_time': post['edited_time'],
+			'length': sum(words.values()),
+			'words': words
+		})
+
+	def add_document(self, post_id, document):
+		self.remove(post_id)
+		self.documents[post_id] = document
+		self.lengths[post_id] = document['length']
+		self.total_length += document['length']
+		for word, count in document['words'].items():
+			self.postings.setdefault(word, {})[post_id] = count
+
+	def remove(self, post_id):
+		document = self.documents.pop(post_id, None)
+		if document is None:
+			return
+		del self.lengths[post_id]
+		self.total_length -= document['length']
+		for word in document['words']:
+			posting = self.postings[word]
+			del posting[post_id]
+			if not posting:
+				del self.postings[word]
+
+	def search(self, query, limit=20, get_hidden=False):
+		'''
+		Returns the best matching posts for the query as a list of dicts with
+		the slug, title, datetime, score, and an html snippet
+		'''
+		query_words = set(tokenize(query[:max_query_length]))
+		# total_length is 0 when no post has any words that aren't stop
+		# words, then nothing can match
+		if not query_words or not self.total_length:
+			return []
+		document_count = len(self.documents)
+		lengths = self.lengths
+		# the parts of bm25 that are the same for every post
+		length_weight = k1 * b * document_count / self.total_length
+		constant = k1 * (1 - b)
+
+		scores = {}
+		for word in query_words:
+			posting = self.postings.get(word)
+			if not posting:
+				continue
+			idf = math.log(1 + (document_count - len(posting) + 0.5) / (len(posting) + 0.5))
+			numerator = idf * (k1 + 1)
+			for post_id, count in posting.items():
+				score = numerator * count / (count + constant + length_weight * lengths[post_id])
+				scores[post_id] = scores.get(post_id, 0) + score
+
+		if not get_hidden:
+			scores = {p: s for p, s in scores.items() if not self.documents[p]['hidden']}
+		best = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+
+		results = []
+		for post_id, score in best:
+			document = self.documents[post_id]
+			results.append({
+				'id': post_id,
+				'slug': document['slug'],
+				'title': document['title'],
+				'datetime': document['datetime'],
+				'hidden': document['hidden'],
+				'score': score,
+				'snippet': make_snippet(document['text'], query_words)
+			})
+		return results
+
+	def to_json(self):
+		documents = {}
+		for post_id, document in self.documents.items():
+			document = dict(document)
+			document['datetime'] = document['datetime'].isoformat()
+			document['edited_time'] = document['edited_time'].isoformat()
+			documents[post_id] = document
+		return json.dumps({'version': version, 'documents': documents})
+
+	def load(self, path):
+		'''
+		Adds the posts from a snapshot file made by to_json, returns whether
+		there was one that could be used
+		'''
+		try:
+			with open(path) as f:
+				data = json.load(f)
+		except (OSError, ValueError):
+			return False
+		if data.get('version') != version:
+			return False
+		for post_id, document in data['documents'].items():
+			document['datetime'] = datetime.fromisoformat(document['datetime'])
+			document['edited_time'] = datetime.fromisoformat(document['edited_time'])
+			self.add_document(post_id, document)
+		return True
+
+	def update(self, posts):
+		'''
+		Makes the index have exactly these posts, only adding the ones that
+		changed since they were indexed. Returns how many were added or
+		removed.
+		'''
+		ids = set()
+		changed = 0
+		for post in posts:
+			ids.add(post['id'])
+			document = self.documents.get(post['id'])
+			if (
+				document is None
+				or document['edited_time'] != post['edited_time']
+				or document['hidden'] != post['hidden']
+				or document['slug'] != post['slug']
+			):
+				self.add(post)
+				changed += 1
+		for post_id in set(self.documents) - ids:
+			self.remove(post_id)
+			changed += 1
+		return changed
+
+
+def write_snapshot(path, data):
+	'''
+	Writes a snapshot from SearchIndex.to_json, it's written to another file
+	first so a crash can't leave half of one
+	'''
+	temp_path = f'{path}.{os.getpid()}.tmp'
+	with open(temp_path, 'w') as f:
+		f.write(data)
+	os.replace(temp_path, path)
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+import time
+
+
+class SessionCache:
+	'''
+	LRU cache of session ids to usernames where every entry expires. Unknown
+	session ids are remembered too, so they don't hit the database every
+	request, but they have their own smaller limit and shorter ttl so random
+	cookies can't push out real sessions.
+	'''
+	def __init__(self, max_entries=1024, ttl=31557600, max_negative=4096, negative_ttl=300):
+		self.ttl = ttl
+		self.negative_ttl = negative_ttl
+		self.sessions = LRU(max_entries)
+		self.negative = LRU(max_negative)
+
+	def get(self, sid):
+		'''
+		Returns (found, username), found is False if the session isn't cached
+		and username is None if the session is known not to exist
+		'''
+		username = self.sessions.get(sid)
+		if username is not None:
+			return True, username
+		if self.negative.get(sid) is not None:
+			return True, None
+		return False, None
+
+	def set(self, sid, username, expires=None):
+		if username is None:
+			self.sessions.remove(sid)
+			self.negative.set(sid, True, time.time() + self.negative_ttl)
+			return
+		if expires is None:
+			expires = time.time() + self.ttl
+		self.negative.remove(sid)
+		self.sessions.set(sid, username, expires)
+
+	def remove(self, sid):
+		self.sessions.remove(sid)
+		self.negative.remove(sid)
+
+	def stats(self):
+		return {
+			'sessions': len(self.sessions.items),
+			'negative': len(self.negative.items),
+		}
+
+
+class LRU:
+	def __init__(self, max_entries):
+		self.max_entries = max_entries
+		self.items = OrderedDict()
+
+	def get(self, key):
+		item = self.items.get(key)
+		if item is None:
+			return None
+		value, expires = item
+		if expires <= time.time():
+			del self.items[key]
+			return None
+		self.items.move_to_end(key)
+		return value
+
+	def set(self, key, value, expires):
+		self.items[key] = (value, expires)
+		self.items.move_to_end(key)
+		while len(self.items) > self.max_entries:
+			self.items.popitem(last=False)
+
+	def remove(self, key):
+		self.items.pop(key, None)
@@ -1,7 +1,7 @@
 import os
 import subprocess
 
-REQUIREMENTS = ('Jinja2', 'motor', 'aiohttp', 'dnspython')
+REQUIREMENTS = ('Jinja2', 'motor', 'aiohttp', 'dnspython', 'brotli', 'Pillow', 'Pygments')
 
 pipfreeze = subprocess.check_output('pip3 freeze', shell=True, universal_newlines=True)
 
@@ -0,0 +1,27 @@
+import os
+import sys
+
+# the modules are at the top of the repo, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import motor.motor_asyncio
+import fakemongo
+# database.connect makes the client with this, so it has to be replaced first
+motor.motor_asyncio.AsyncIOMotorClient = fakemongo.FakeClient
+
+import pytest
+import database
+
+
+@pytest.fixture
+def db():
+	'''
+	database connected to an empty in-memory mongo
+	'''
+	database.close()
+	# fake clients share their data, like they're all connected to one server
+	fakemongo.FakeClient.shared_databases.clear()
+	database.sessions = database.sessioncache.SessionCache()
+	database.connect()
+	yield database
+	database.close()
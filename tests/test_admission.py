@@ -0,0 +1,108 @@
+import asyncio
+import time
+import pytest
+from aiohttp import web
+import admission
+
+
+class Clock:
+	# stands in for the time module in admission, asyncio needs the real one
+	def __init__(self):
+		self.now = 1000.0
+		self.start = time.time()
+
+	def monotonic(self):
+		return self.now
+
+	def time(self):
+		# buckets expire in an LRU that uses the real time
+		return self.start + self.now - 1000.0
+
+@pytest.fixture
+def clock(monkeypatch):
+	clock = Clock()
+	monkeypatch.setattr(admission, 'time', clock)
+	return clock
+
+
+def test_burst_then_rate(clock):
+	limit = admission.RouteLimit(concurrency=1, max_waiting=1, rate=2, burst=3)
+	assert [limit.take_token('ip') for _ in range(4)] == [True, True, True, False]
+	clock.now += 0.25
+	assert not limit.take_token('ip')
+	clock.now += 0.25
+	assert limit.take_token('ip')
+	assert not limit.take_token('ip')
+
+def test_bucket_doesnt_go_over_burst(clock):
+	limit = admission.RouteLimit(concurrency=1, max_waiting=1, rate=1, burst=2)
+	limit.take_token('ip')
+	clock.now += 100
+	assert [limit.take_token('ip') for _ in range(3)] == [True, True, False]
+
+def test_ips_have_their_own_buckets(clock):
+	limit = admission.RouteLimit(concurrency=1, max_waiting=1, rate=1, burst=1)
+	assert limit.take_token('a')
+	assert not limit.take_token('a')
+	assert limit.take_token('b')
+
+
+async def wait_until(condition):
+	for _ in range(100):
+		if condition():
+			return
+		await asyncio.sleep(0)
+	raise AssertionError('condition never became true')
+
+async def ok(request):
+	return 'ok'
+
+def test_rate_limited_request(clock):
+	limit = admission.RouteLimit(concurrency=1, max_waiting=1, rate=0.5, burst=1)
+	async def run():
+		assert await limit.handle('ip', ok, None) == 'ok'
+		with pytest.raises(web.HTTPTooManyRequests) as e:
+			await limit.handle('ip', ok, None)
+		return e.value
+	error = asyncio.run(run())
+	assert error.headers['Retry-After'] == '2'
+	assert limit.shed['rate'] == 1
+
+def test_full_queue_is_rejected():
+	limit = admission.RouteLimit(concurrency=1, max_waiting=1, rate=100, burst=100)
+	async def run():
+		release = asyncio.Event()
+		async def slow(request):
+			await release.wait()
+			return 'slow'
+		running = asyncio.ensure_future(limit.handle('a', slow, None))
+		waiting = asyncio.ensure_future(limit.handle('b', slow, None))
+		await wait_until(lambda: limit.in_flight == 1 and limit.waiting == 1)
+		assert limit.stats()['in_flight'] == 1
+		assert limit.stats()['waiting'] == 1
+		with pytest.raises(web.HTTPServiceUnavailable):
+			await limit.handle('c', ok, None)
+		release.set()
+		return await running, await waiting
+	assert asyncio.run(run()) == ('slow', 'slow')
+	assert limit.shed == {'rate': 0, 'queue': 1, 'timeout': 0}
+	assert limit.stats()['in_flight'] == 0
+
+def test_waiting_too_long_is_rejected():
+	limit = admission.RouteLimit(concurrency=1, max_waiting=5, rate=100, burst=100, wait_timeout=0.01)
+	async def run():
+		release = asyncio.Event()
+		async def slow(request):
+			await release.wait()
+			return 'slow'
+		running = asyncio.ensure_future(limit.handle('a', slow, None))
+		await wait_until(lambda: limit.in_flight == 1)
+		with pytest.raises(web.HTTPServiceUnavailable):
+			await limit.handle('b', ok, None)
+		assert limit.waiting == 0
+		release.set()
+		await running
+		# the timed out request didn't keep a place
+		assert await limit.handle('c', ok, None) == 'ok'
+	asyncio.run(run())
+	assert limit.shed['timeout'] == 1
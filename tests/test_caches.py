@@ -0,0 +1,130 @@
+import time
+import pagecache
+from sessioncache import LRU, SessionCache
+
+
+def test_lru_evicts_least_recently_used():
+	cache = LRU(2)
+	expires = time.time() + 60
+	cache.set('a', 1, expires)
+	cache.set('b', 2, expires)
+	# using a makes b the oldest
+	assert cache.get('a') == 1
+	cache.set('c', 3, expires)
+	assert cache.get('b') is None
+	assert cache.get('a') == 1
+	assert cache.get('c') == 3
+
+def test_lru_setting_again_moves_to_end():
+	cache = LRU(2)
+	expires = time.time() + 60
+	cache.set('a', 1, expires)
+	cache.set('b', 2, expires)
+	cache.set('a', 10, expires)
+	cache.set('c', 3, expires)
+	assert cache.get('a') == 10
+	assert cache.get('b') is None
+
+def test_lru_expiry():
+	cache = LRU(10)
+	cache.set('old', 1, time.time() - 1)
+	cache.set('new', 2, time.time() + 60)
+	assert cache.get('old') is None
+	assert 'old' not in cache.items
+	assert cache.get('new') == 2
+
+def test_session_expiry():
+	sessions = SessionCache()
+	sessions.set('expired', 'mat', time.time() - 1)
+	sessions.set('valid', 'mat', time.time() + 60)
+	assert sessions.get('expired') == (False, None)
+	assert sessions.get('valid') == (True, 'mat')
+	assert sessions.get('unknown') == (False, None)
+
+def test_session_default_ttl():
+	sessions = SessionCache(ttl=0)
+	sessions.set('sid', 'mat')
+	assert sessions.get('sid') == (False, None)
+
+def test_unknown_sessions_are_remembered():
+	sessions = SessionCache()
+	sessions.set('missing', None)
+	assert sessions.get('missing') == (True, None)
+	# logging in replaces it
+	sessions.set('missing', 'mat')
+	assert sessions.get('missing') == (True, 'mat')
+	sessions.set('missing', None)
+	assert sessions.get('missing') == (True, None)
+
+def test_unknown_sessions_expire_sooner():
+	sessions = SessionCache(negative_ttl=0)
+	sessions.set('missing', None)
+	assert sessions.get('missing') == (False, None)
+
+def test_unknown_sessions_dont_push_out_real_ones():
+	sessions = SessionCache(max_entries=2, max_negative=2)
+	sessions.set('a', 'mat')
+	sessions.set('b', 'mat')
+	for i in range(10):
+		sessions.set(f'random {i}', None)
+	assert sessions.get('a') == (True, 'mat')
+	assert sessions.get('b') == (True, 'mat')
+	assert sessions.stats() == {'sessions': 2, 'negative': 2}
+
+
+def make_page(path, size):
+	return pagecache.CachedPage(path, b'x' * size, 'text/html', 'utf-8')
+
+def test_page_cache_evicts_by_entries():
+	cache = pagecache.PageCache(max_entries=2)
+	cache.set('/a', make_page('/a', 10))
+	cache.set('/b', make_page('/b', 10))
+	cache.get('/a')
+	cache.set('/c', make_page('/c', 10))
+	assert cache.get('/b') is None
+	assert cache.get('/a') is not None
+	assert cache.stats()['evictions'] == 1
+
+def test_page_cache_evicts_by_size():
+	cache = pagecache.PageCache(max_bytes=100)
+	cache.set('/a', make_page('/a', 40))
+	cache.set('/b', make_page('/b', 40))
+	cache.set('/c', make_page('/c', 40))
+	assert cache.get('/a') is None
+	assert cache.size == 80
+
+def test_page_cache_skips_pages_bigger_than_it():
+	cache = pagecache.PageCache(max_bytes=100)
+	cache.set('/a', make_page('/a', 40))
+	cache.set('/big', make_page('/big', 101))
+	assert cache.get('/big') is None
+	assert cache.get('/a') is not None
+
+def test_page_cache_counts_compressed_bodies():
+	cache = pagecache.PageCache()
+	page = make_page('/a', 1000)
+	cache.set('/a', page)
+	body = cache.get_encoded('/a', page, 'gzip')
+	assert cache.get_encoded('/a', page, 'gzip') is body
+	assert cache.size == 1000 + len(body)
+	cache.remove('/a')
+	assert cache.size == 0
+
+def test_page_cache_replacing_a_page():
+	cache = pagecache.PageCache()
+	cache.set('/a', make_page('/a', 10))
+	cache.set('/a', make_page('/a', 30))
+	assert cache.size == 30
+	assert len(cache.pages) == 1
+
+def test_page_cache_invalidates_every_page_of_a_path():
+	cache = pagecache.PageCache()
+	cache.set('/blog', make_page('/blog', 10))
+	cache.set('/blog?before=x', make_page('/blog', 10))
+	cache.set('/rss', make_page('/rss', 10))
+	cache.invalidate('/blog')
+	assert cache.get('/blog') is None
+	assert cache.get('/blog?before=x') is None
+	assert cache.get('/rss') is not None
+	assert cache.paths == {'/rss': {'/rss'}}
+	assert cache.stats()['invalidations'] == 2
@@ -0,0 +1,47 @@
+import struct
+import pytest
+import imagesize
+
+
+def png(width, height):
+	return b'\x89PNG\r\n\x1a\n' + struct.pack('>L', 13) + b'IHDR' + struct.pack('>LL', width, height) + b'\x08\x06\x00\x00\x00'
+
+def jpeg(width, height, padding=0):
+	# an app0 segment with some padding before the start of frame
+	app0 = b'\xff\xe0' + struct.pack('>H', 16 + padding) + b'JFIF\x00' + b'\x00' * (9 + padding)
+	sof = b'\xff\xc0' + struct.pack('>HBHH', 17, 8, height, width) + b'\x03' + b'\x00' * 9
+	return b'\xff\xd8' + app0 + sof
+
+
+def test_png():
+	assert imagesize.get_image_size(png(640, 480)) == (640, 480)
+
+def test_gif():
+	assert imagesize.get_image_size(b'GIF89a' + struct.pack('<HH', 20, 10) + b'\x00' * 4) == (20, 10)
+
+def test_jpeg():
+	assert imagesize.get_image_size(jpeg(1920, 1080)) == (1920, 1080)
+	assert imagesize.get_image_size(jpeg(1, 2, padding=5000)) == (1, 2)
+
+def test_webp_vp8x():
+	data = b'RIFF' + b'\x00' * 4 + b'WEBP' + b'VP8X' + b'\x00' * 8 + (99).to_bytes(3, 'little') + (49).to_bytes(3, 'little')
+	assert imagesize.get_image_size(data) == (100, 50)
+
+@pytest.mark.parametrize('data', [
+	png(640, 480)[:20],
+	jpeg(1920, 1080)[:24],
+	b'\xff\xd8',
+	b'GIF89a',
+	b'',
+])
+def test_needs_more_data(data):
+	assert imagesize.get_image_size(data) is None
+
+def test_jpeg_without_size_in_header():
+	data = b'\xff\xd8' + (b'\xff\xe1' + struct.pack('>H', 1000) + b'\x00' * 998) * 70
+	with pytest.raises(imagesize.ImageSizeError):
+		imagesize.get_image_size(data[:imagesize.max_header_size])
+
+def test_unknown_format():
+	with pytest.raises(imagesize.ImageSizeError):
+		imagesize.get_image_size(b'<html><body>not an image</body></html>')
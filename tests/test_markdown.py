@@ -0,0 +1,42 @@
+import json
+import os
+import time
+import markdown
+import markdown_golden
+import renderpool
+
+
+def test_golden_corpus():
+	path = os.path.join(os.path.dirname(markdown_golden.__file__), markdown_golden.default_path)
+	with open(path) as f:
+		cases = json.load(f)
+	assert markdown_golden.check(cases) == 0
+
+def test_linear_time():
+	assert markdown_golden.check_scaling() == 0
+
+def test_inline_renders_are_fast():
+	# renders shorter than the inline limit aren't covered by the timeout
+	for make_input in markdown_golden.scaling_inputs.values():
+		content = make_input(renderpool.inline_limit - 1)[:renderpool.inline_limit - 1]
+		start = time.perf_counter()
+		markdown.compile_markdown(content)
+		markdown.compile_markdown(content, plain=True)
+		assert time.perf_counter() - start < 2
+
+def test_find_images():
+	content = 'a ![cat](/cat.png) b ,![left](https://x.com/l.png)\n![not closed](\n![x](/y.png)'
+	assert markdown.find_images(content) == [('cat', '/cat.png'), ('left', 'https://x.com/l.png'), ('x', '/y.png')]
+	# the first ]( that ends an image on the same line ends it
+	assert markdown.find_images('![a](/x) ](/y)') == [('a', '/x')]
+	assert markdown.find_images('![a\n](/x)') == []
+
+def test_stars():
+	# bold was done before italic, so a * only doesn't end an italic if
+	# it starts a bold
+	assert markdown.compile_markdown('*i**i*') == '<i>i</i><i>i</i>'
+	assert markdown.compile_markdown('*a **b** c*') == '<i>a <b>b</b> c</i>'
+	assert markdown.compile_markdown('*a**b**') == '*a<b>b</b>'
+	assert markdown.compile_markdown('\\**b**') == '&#42;<i>b</i>*'
+	assert markdown.compile_markdown('x ***y***') == 'x <b><i>y</i></b>'
+	assert markdown.compile_markdown('x ***y***', plain=True) == 'x y'
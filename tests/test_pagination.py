@@ -0,0 +1,124 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+
+
+def add_posts(db, count, hidden=()):
+	'''
+	Adds count posts a day apart, post 0 is the oldest. Returns their ids
+	from newest to oldest, not counting hidden ones.
+	'''
+	async def add():
+		ids = []
+		for i in range(count):
+			document = await db.get_blog_post_dict(f'Post {i}', f'Post number {i}', 'mat', unlisted=i in hidden)
+			document['datetime'] = datetime(2020, 1, 1) + timedelta(days=i)
+			await db.blog_posts.insert_one(document)
+			if i not in hidden:
+				ids.append(document['_id'])
+		return ids[::-1]
+	return asyncio.run(add())
+
+def get_page(db, page_size, before=None, after=None, get_hidden=False):
+	before = None if before is None else db.decode_cursor(before)
+	after = None if after is None else db.decode_cursor(after)
+	posts, newer, older = asyncio.run(db.get_blog_post_page(page_size, get_hidden=get_hidden, before=before, after=after))
+	return [post['id'] for post in posts], newer, older
+
+
+def test_pages_going_back(db):
+	ids = add_posts(db, 25)
+	page, newer, older = get_page(db, 10)
+	assert page == ids[:10]
+	assert newer is None and older is not None
+
+	page, newer, older = get_page(db, 10, before=older)
+	assert page == ids[10:20]
+	assert newer is not None and older is not None
+
+	page, newer, older = get_page(db, 10, before=older)
+	assert page == ids[20:]
+	assert newer is not None and older is None
+
+def test_pages_going_forward(db):
+	ids = add_posts(db, 25)
+	_, _, older = get_page(db, 10)
+	_, _, older = get_page(db, 10, before=older)
+	_, newer, _ = get_page(db, 10, before=older)
+
+	page, newer, older = get_page(db, 10, after=newer)
+	assert page == ids[10:20]
+	assert newer is not None and older is not None
+
+def test_exactly_a_page_of_newer_posts(db):
+	ids = add_posts(db, 25)
+	_, _, older = get_page(db, 10)
+	_, newer, _ = get_page(db, 10, before=older)
+	# the 10 posts newer than this are the first page, which has no newer link
+	page, newer, older = get_page(db, 10, after=newer)
+	assert page == ids[:10]
+	assert newer is None and older is not None
+
+def test_fewer_than_a_page_of_newer_posts(db):
+	ids = add_posts(db, 25)
+	cursor = db.encode_cursor({'datetime': datetime(2020, 1, 1) + timedelta(days=20), 'id': ids[4]})
+	page, newer, older = get_page(db, 10, after=cursor)
+	assert page == ids[:10]
+	assert newer is None
+
+def test_exactly_full_last_page(db):
+	ids = add_posts(db, 20)
+	_, _, older = get_page(db, 10)
+	page, newer, older = get_page(db, 10, before=older)
+	assert page == ids[10:]
+	assert newer is not None and older is None
+
+def test_empty_page(db):
+	ids = add_posts(db, 5)
+	_, _, older = get_page(db, 4)
+	_, _, older = get_page(db, 4, before=older)
+	assert older is None
+	oldest = db.encode_cursor({'datetime': datetime(2020, 1, 1), 'id': ids[-1]})
+	assert get_page(db, 4, before=oldest) == ([], None, None)
+
+def test_no_posts(db):
+	assert get_page(db, 10) == ([], None, None)
+
+def test_hidden_posts(db):
+	ids = add_posts(db, 12, hidden={3, 7})
+	page, _, older = get_page(db, 5)
+	assert page == ids[:5]
+	page, _, older = get_page(db, 5, before=older)
+	assert page == ids[5:]
+	assert older is None
+	page, _, _ = get_page(db, 20, get_hidden=True)
+	assert len(page) == 12
+
+def test_posts_at_the_same_time(db):
+	async def add():
+		for i in range(6):
+			document = await db.get_blog_post_dict(f'Post {i}', 'text', 'mat')
+			document['datetime'] = datetime(2020, 1, 1)
+			await db.blog_posts.insert_one(document)
+	asyncio.run(add())
+	first, _, older = get_page(db, 4)
+	second, _, _ = get_page(db, 4, before=older)
+	assert len(first) == 4 and len(second) == 2
+	assert not set(first) & set(second)
+
+
+def test_cursor_round_trip(db):
+	post = {'datetime': datetime(2021, 2, 3, 4, 5, 6, 7), 'id': 'abc-def'}
+	assert db.decode_cursor(db.encode_cursor(post)) == (post['datetime'], 'abc-def')
+
+@pytest.mark.parametrize('cursor', [
+	'',
+	'nope',
+	'-abc',
+	'2020-abc',
+	'20201301000000000000-abc',
+	'abcdefghijklmnopqrst-abc',
+])
+def test_malformed_cursor(db, cursor):
+	with pytest.raises(ValueError):
+		db.decode_cursor(cursor)
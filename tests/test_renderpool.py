@@ -0,0 +1,51 @@
+import asyncio
+import os
+import time
+import pytest
+import renderpool
+
+
+def sleep(seconds):
+	time.sleep(seconds)
+	return os.getpid()
+
+@pytest.fixture
+def pool(monkeypatch):
+	monkeypatch.setattr(renderpool, 'max_processes', 1)
+	monkeypatch.setattr(renderpool, 'inline_limit', 10)
+	monkeypatch.setattr(renderpool, 'timeout', 1)
+	yield
+	renderpool.close()
+
+
+def test_small_inputs_are_inline(pool):
+	assert asyncio.run(renderpool.run(sleep, 9, 0)) == os.getpid()
+	assert renderpool.pool.executor is None
+
+def test_timeout_retries_the_others(pool):
+	async def run():
+		slow = asyncio.ensure_future(renderpool.run(sleep, 10, 5))
+		await asyncio.sleep(0.3)
+		# waiting behind the slow one when the pool is killed
+		waiting = asyncio.ensure_future(renderpool.run(sleep, 10, 0))
+		with pytest.raises(renderpool.RenderTimeout):
+			await slow
+		return await waiting
+	pid = asyncio.run(run())
+	assert pid != os.getpid()
+
+def test_fork_makes_a_new_pool(pool):
+	asyncio.run(renderpool.run(sleep, 10, 0))
+	assert renderpool.pool.executor is not None
+	pid = os.fork()
+	if pid == 0:
+		code = 1
+		try:
+			if renderpool.pool.executor is None:
+				asyncio.run(renderpool.run(sleep, 10, 0))
+				code = 0
+		finally:
+			renderpool.close()
+			os._exit(code)
+	_, status = os.waitpid(pid, 0)
+	assert os.WEXITSTATUS(status) == 0
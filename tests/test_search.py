@@ -0,0 +1,43 @@
+from datetime import datetime
+import search
+
+
+def make_post(post_id, title, text, hidden=False):
+	return {
+		'id': post_id,
+		'slug': title.lower().replace(' ', '-'),
+		'title': title,
+		'text': text,
+		'hidden': hidden,
+		'datetime': datetime(2020, 1, 1),
+		'edited_time': datetime(2020, 1, 1),
+	}
+
+
+def test_search_ranks_matching_posts():
+	index = search.SearchIndex()
+	index.add(make_post('1', 'Cats', 'a post about cats and more cats'))
+	index.add(make_post('2', 'Dogs', 'a post about dogs, and a cat'))
+	index.add(make_post('3', 'Birds', 'nothing here'))
+	assert [result['id'] for result in index.search('cat')] == ['1', '2']
+
+def test_hidden_posts_are_only_found_by_admins():
+	index = search.SearchIndex()
+	index.add(make_post('1', 'Secret', 'hidden words', hidden=True))
+	assert index.search('hidden') == []
+	assert [result['id'] for result in index.search('hidden', get_hidden=True)] == ['1']
+
+def test_posts_without_words():
+	index = search.SearchIndex()
+	assert index.search('the thing') == []
+	# only stop words, so nothing is indexed
+	index.add(make_post('1', 'The', ''))
+	assert index.search('the thing') == []
+	assert index.search('thing') == []
+
+def test_text_is_unescaped():
+	index = search.SearchIndex()
+	index.add(make_post('1', 'Quotes', 'say &quot;hello&quot; &amp; wave'))
+	assert index.search('quot') == []
+	assert index.search('amp') == []
+	assert 'say &quot;<mark>hello</mark>&quot; &amp; wave' in index.search('hello')[0]['snippet']
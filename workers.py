@@ -0,0 +1,155 @@
+import asyncio
+import gc
+import json
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+from aiohttp import web
+import log
+
+'''
+Runs the app in multiple processes. The caches are warmed once in the main
+process and then it forks, so every worker starts with them (shared copy on
+write until they're changed). Each worker listens on the same port with
+SO_REUSEPORT and the kernel spreads connections between them.
+
+Workers tell each other when something changes with publish, every worker
+has a unix datagram socket in the same directory and messages are sent to
+all of them except the sender's.
+'''
+
+
+class peers:
+	# the directory with every worker's socket, None if there's only one
+	# process so there's nobody to tell
+	directory = None
+	transport = None
+
+
+class PeerProtocol(asyncio.DatagramProtocol):
+	def __init__(self, handler):
+		self.handler = handler
+
+	def datagram_received(self, data, addr):
+		try:
+			message = json.loads(data)
+		except ValueError:
+			return
+		asyncio.ensure_future(self.handler(message))
+
+
+def get_socket_path(pid):
+	return os.path.join(peers.directory, f'{pid}.sock')
+
+async def listen(handler):
+	'''
+	Calls the handler coroutine with every message published by the other
+	workers
+	'''
+	if peers.directory is None:
+		return
+	path = get_socket_path(os.getpid())
+	if os.path.exists(path):
+		os.remove(path)
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+	sock.bind(path)
+	sock.setblocking(False)
+	peers.transport, _ = await asyncio.get_event_loop().create_datagram_endpoint(
+		lambda: PeerProtocol(handler), sock=sock
+	)
+
+def publish(message):
+	if peers.directory is None or peers.transport is None:
+		return
+	data = json.dumps(message).encode()
+	own_path = get_socket_path(os.getpid())
+	for filename in os.listdir(peers.directory):
+		path = os.path.join(peers.directory, filename)
+		if path == own_path:
+			continue
+		try:
+			peers.transport.sendto(data, path)
+		except OSError:
+			# the worker died and is being replaced
+			pass
+
+def close():
+	if peers.transport is not None:
+		peers.transport.close()
+		peers.transport = None
+
+
+def run_worker(create_app, host, port):
+	# the main process handles these for everyone
+	signal.signal(signal.SIGINT, signal.SIG_DFL)
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+	web.run_app(create_app(), host=host, port=port, reuse_port=True, print=None)
+
+def fork_worker(create_app, host, port):
+	pid = os.fork()
+	if pid == 0:
+		code = 0
+		try:
+			run_worker(create_app, host, port)
+		except BaseException:
+			log.error('worker crashed', exc_info=True)
+			code = 1
+		finally:
+			# atexit doesn't happen with _exit
+			log.close()
+			os._exit(code)
+	return pid
+
+def run(create_app, warm, host='0.0.0.0', port=8080, worker_count=None):
+	'''
+	Awaits warm, then forks worker_count workers (one per cpu by default)
+	that each run the app from create_app, and restarts any that die
+	'''
+	if worker_count is None:
+		worker_count = os.cpu_count() or 1
+	asyncio.run(warm())
+
+	peers.directory = tempfile.mkdtemp(prefix='workers-')
+	# objects made before forking are never going to be freed, so the
+	# garbage collector doesn't need to touch (and copy) their pages
+	gc.freeze()
+
+	workers = set()
+	stopping = False
+
+	def stop(signum, frame):
+		nonlocal stopping
+		stopping = True
+		for pid in workers:
+			try:
+				os.kill(pid, signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+
+	signal.signal(signal.SIGINT, stop)
+	signal.signal(signal.SIGTERM, stop)
+
+	for _ in range(worker_count):
+		workers.add(fork_worker(create_app, host, port))
+	log.info('started workers', count=worker_count, url=f'http://{host}:{port}')
+
+	try:
+		while workers:
+			try:
+				pid, status = os.wait()
+			except ChildProcessError:
+				break
+			workers.discard(pid)
+			socket_path = get_socket_path(pid)
+			if os.path.exists(socket_path):
+				os.remove(socket_path)
+			if not stopping:
+				log.warning('worker exited, starting another one', pid=pid, status=status)
+				# so a worker that can't start doesn't use all the cpu
+				time.sleep(1)
+				workers.add(fork_worker(create_app, host, port))
+	finally:
+		shutil.rmtree(peers.directory, ignore_errors=True)